@@ -0,0 +1,201 @@
+import numpy as np
+from collections import defaultdict
+
+# Number of bits set in each byte value.
+POPCOUNT = np.array([bin(b).count('1') for b in range(256)], dtype=np.uint8)
+
+# Rows unpacked at a time by col_counts, to bound the temporary memory.
+UNPACK_BLOCK_ROWS = 4096
+
+class BitMatrix(object):
+	"""
+	Boolean matrix with 8 cells per byte (np.packbits along the rows), for the binary drug x side-effect
+	associations: post-marketing, indications, side-effects with no frequency, ... A float64 matrix of
+	the same shape takes 64 times more memory.
+	The padding bits at the end of each row are always 0, so &, | and andnot (also -) work byte-wise.
+	"""
+	def __init__(self, bits, n_cols):
+		'''
+		:param bits: uint8 array (rows, ceil(n_cols / 8)), as given by np.packbits(dense, axis=1).
+		:param n_cols: number of columns.
+		'''
+		self.bits = np.asarray(bits, dtype=np.uint8)
+		self.n_cols = n_cols
+
+	@classmethod
+	def zeros(cls, n_rows, n_cols):
+
+		return cls(np.zeros((n_rows, (n_cols + 7) // 8), dtype=np.uint8), n_cols)
+
+	@classmethod
+	def from_dense(cls, M):
+		'''
+		From a dense matrix, e.g. the output of MyUtilities.DoubleDicttoMatrixConstrainedValue (non zero = True).
+		'''
+		M = np.asarray(M)
+
+		return cls(np.packbits(M != 0, axis=1), M.shape[1])
+
+	@classmethod
+	def from_indices(cls, rows, cols, n_rows, n_cols):
+		'''
+		From the (row, column) positions of the True cells.
+		'''
+		rows = np.asarray(rows, dtype=np.int64)
+		cols = np.asarray(cols, dtype=np.int64)
+
+		matrix = cls.zeros(n_rows, n_cols)
+		# several cells can fall in the same byte: unbuffered or.
+		np.bitwise_or.at(matrix.bits, (rows, cols >> 3), (128 >> (cols & 7)).astype(np.uint8))
+
+		return matrix
+
+	@classmethod
+	def from_set_dict(cls, mydict, row_index, column_index):
+		'''
+		From a dict {drug: set(side-effects)} (or lists, or dicts keyed by side-effect), e.g. the outputs of
+		SIDERParser.parser_meddra_all_se(...), UnifySetsPostmarketing(...) or SideEffectswithNoFrequency(...).
+		Drugs and side-effects that are not in the indexes are left out.
+		:param row_index: dict drug -> row (e.g. SIDERVocabulary.drugs.index, or MyUtilities.MatrixIndex).
+		:param column_index: dict side-effect -> column.
+		'''
+		rows = list()
+		cols = list()
+
+		for r, values in mydict.iteritems():
+			idx1 = row_index.get(r)
+			if idx1 is None:
+				continue
+
+			for c in values:
+				idx2 = column_index.get(c)
+				if idx2 is not None:
+					rows.append(idx1)
+					cols.append(idx2)
+
+		n_rows = max(row_index.itervalues()) + 1 if row_index else 0
+		n_cols = max(column_index.itervalues()) + 1 if column_index else 0
+
+		return cls.from_indices(rows, cols, n_rows, n_cols)
+
+	def resize(self, n_rows, n_cols):
+		'''
+		Copy with more rows and columns (False), e.g. after new drugs or side-effects were added to the vocabulary.
+		'''
+		if n_rows < self.bits.shape[0] or n_cols < self.n_cols:
+			raise ValueError('The matrix can only grow: %s to %s.' % (self.shape, (n_rows, n_cols)))
+
+		matrix = BitMatrix.zeros(n_rows, n_cols)
+		matrix.bits[:self.bits.shape[0], :self.bits.shape[1]] = self.bits
+
+		return matrix
+
+	@property
+	def shape(self):
+
+		return (self.bits.shape[0], self.n_cols)
+
+	def to_dense(self, dtype = float):
+		'''
+		Dense matrix of 0 and 1, as DoubleDicttoMatrixConstrainedValue(..., value=1).
+		'''
+		return np.unpackbits(self.bits, axis=1)[:, :self.n_cols].astype(dtype)
+
+	def nonzero(self):
+		'''
+		:return: rows, columns of the True cells (row by row).
+		'''
+		byte_rows, byte_cols = np.nonzero(self.bits)
+
+		if len(byte_rows) == 0:
+			return byte_rows, byte_cols
+
+		# bits of the non zero bytes only.
+		unpacked = np.unpackbits(self.bits[byte_rows, byte_cols][:, np.newaxis], axis=1)
+		which, bit = np.nonzero(unpacked)
+
+		return byte_rows[which], byte_cols[which] * 8 + bit
+
+	def to_set_dict(self, row_labels, column_labels):
+		'''
+		Inverse of from_set_dict.
+		:param row_labels: label of each row (e.g. SIDERVocabulary.drugs.labels).
+		:param column_labels: label of each column.
+		:return: defaultdict(set)
+		'''
+		mydict = defaultdict(set)
+
+		for r, c in zip(*self.nonzero()):
+			mydict[row_labels[r]].add(column_labels[c])
+
+		return mydict
+
+	def row_counts(self):
+		'''
+		Number of True cells of each row.
+		'''
+		return POPCOUNT[self.bits].sum(axis=1, dtype=np.int64)
+
+	def col_counts(self):
+		'''
+		Number of True cells of each column.
+		'''
+		counts = np.zeros(self.bits.shape[1] * 8, dtype=np.int64)
+
+		for start in range(0, self.bits.shape[0], UNPACK_BLOCK_ROWS):
+			counts += np.unpackbits(self.bits[start:start + UNPACK_BLOCK_ROWS], axis=1).sum(axis=0, dtype=np.int64)
+
+		return counts[:self.n_cols]
+
+	def count(self):
+		'''
+		Number of True cells.
+		'''
+		return int(POPCOUNT[self.bits].sum(dtype=np.int64))
+
+	def __check(self, other):
+
+		if self.shape != other.shape:
+			raise ValueError('The shapes of the matrices do not match: %s and %s.' % (self.shape, other.shape))
+
+	def __and__(self, other):
+
+		self.__check(other)
+		return BitMatrix(self.bits & other.bits, self.n_cols)
+
+	def __or__(self, other):
+
+		self.__check(other)
+		return BitMatrix(self.bits | other.bits, self.n_cols)
+
+	def andnot(self, other):
+		'''
+		Cells that are True in self and False in other.
+		'''
+		self.__check(other)
+		return BitMatrix(self.bits & ~other.bits, self.n_cols)
+
+	def __sub__(self, other):
+
+		return self.andnot(other)
+
+	def mask_rows(self, rows):
+		'''
+		Keep only the rows that are True in the boolean vector rows.
+		'''
+		return BitMatrix(self.bits * np.asarray(rows, dtype=np.uint8)[:, np.newaxis], self.n_cols)
+
+	def mask_columns(self, columns):
+		'''
+		Keep only the columns that are True in the boolean vector columns.
+		'''
+		columns = np.packbits(np.asarray(columns, dtype=bool))
+		return BitMatrix(self.bits & columns[np.newaxis, :], self.n_cols)
+
+	def __eq__(self, other):
+
+		return self.shape == other.shape and np.array_equal(self.bits, other.bits)
+
+	def __ne__(self, other):
+
+		return not self == other
@@ -0,0 +1,62 @@
+from collections import namedtuple
+
+# Kinds of frequency description.
+EXACT = 'exact'
+RANGE = 'range'
+LABEL = 'label'
+
+# Parsed description:
+#	kind: EXACT, RANGE or LABEL.
+#	values: (frequency,) for EXACT, (lower, upper) for RANGE, () for LABEL.
+#	label: normalized label for LABEL (e.g. 'frequent', 'postmarketing'), None otherwise.
+FrequencyDescription = namedtuple('FrequencyDescription', ['kind', 'values', 'label'])
+
+class FrequencyParser(object):
+	"""
+	Parser of the frequency descriptions found in meddra_freq.tsv: "5%", "1-5%", "1 to 10%", "<1%",
+	"common", "postmarketing", ...
+	SIDER has only a few thousand distinct descriptions, so each one is parsed once and cached.
+	"""
+	def __init__(self, normalize_label = None):
+		'''
+		:param normalize_label: function applied to the labels, e.g. 'common' -> 'frequent'.
+		'''
+		self.normalize_label = normalize_label
+		self.cache = dict()
+
+	def parse(self, fq):
+		'''
+		Parse a frequency description.
+		:param fq: description, as in the 5th column of meddra_freq.tsv.
+		:return: FrequencyDescription
+		'''
+		description = self.cache.get(fq)
+
+		if description is None:
+			description = self.__parse(fq)
+			self.cache[fq] = description
+
+		return description
+
+	def __parse(self, fq):
+		'''
+		Exact percentage, range of percentages (1-9%, 1 to 9%, < 1-9%) or label.
+		'''
+		# Frequency is an exact number
+		try:
+			return FrequencyDescription(EXACT, (float(fq.strip('%')),), None)
+		except ValueError:
+			pass
+
+		fq = fq.replace('%','').replace(' ','').replace('-',';').replace('to',';').replace('<','')
+
+		# is a range of frequency, we keep both bounds.
+		if ';' in fq:
+			bounds = fq.split(';')
+			return FrequencyDescription(RANGE, (float(bounds[0]), float(bounds[1])), None)
+
+		# is a label frequency
+		if self.normalize_label is not None:
+			fq = self.normalize_label(fq)
+
+		return FrequencyDescription(LABEL, (), fq)
@@ -0,0 +1,231 @@
+import hashlib
+from collections import defaultdict, Counter
+
+import Parsers as parsers
+import Utilities as utilities
+import SIDERParser as siderparser
+
+# Default name of the snapshot in the results directory.
+SNAPSHOT_NAME = 'sider_snapshot.pkl'
+
+# Set operations of preprocessingToFrequencyLabels(...) kept by UnifySets(...).
+UNIFIED_OPERATIONS = ["A-[B U C]","B-[A U C]", "A & B", "A & C", "B & C"]
+
+def _row_hash(rows):
+	'''
+		Hash of the rows of a drug-se pair (or of a drug), to detect the ones that changed between releases.
+	'''
+	return hashlib.md5(repr(rows)).digest()
+
+class IncrementalSIDER(object):
+	"""
+	Incremental processing of the SIDER releases. The snapshot keeps, for the last ingested release:
+		freq_hashes: hash of the rows of meddra_freq.tsv of each drug-se pair ("drug|se", STITCH stereo ID and MedDRA term).
+		all_se_hashes: hash of the side-effects of each drug in meddra_all_se.tsv.
+		pair_means: average frequency of each pair (removepairsInconsistencyFrequency(...)).
+		postmarketing: drug -> post-marketing only side-effects (before the restriction to unique_se_with_freq).
+		sider_with_freq, se_drug_count: final profile (finalDrugSElist(...)) and number of drugs of each side-effect.
+	update() diffs a new release against it: only the pairs that were added, changed or removed go through
+	se_freq_breakdown -> preprocessingToFrequencyLabels -> UnifySets -> removepairsInconsistencyFrequency, and the
+	profile is patched in place. All these steps work pair by pair, so the result is the same as a full run.
+	The pairs are kept as "drug|se" keys, not PairStore indexes: the snapshot is compared with later releases,
+	whose stores number the pairs differently.
+	"""
+	def __init__(self, my_preferred_term = 'PT', data_directory = None, frequency_scale = None):
+		'''
+			data_directory: folder of the SIDER files (EasyParsers().get_data_directory() if None).
+			frequency_scale: see SIDERParser.SIDERParser.
+		'''
+		self.my_preferred_term = my_preferred_term
+		self.data_directory = data_directory
+		self.frequency_scale = frequency_scale
+
+		self.easyparser = parsers.EasyParsers()
+		self.utilities = utilities.MyUtilities()
+
+		self.freq_hashes = dict()
+		self.all_se_hashes = dict()
+		self.pair_means = dict()
+		self.postmarketing = defaultdict(set)
+		self.sider_with_freq = dict()
+		self.se_drug_count = Counter()
+		self.all_se = defaultdict(set)
+
+		# pairs whose value changed in the last update.
+		self.touched_pairs = list()
+
+	def __parser(self):
+		'''
+			A new SIDERParser, so that the files of the new release are read (the parser keeps meddra_all_se.tsv).
+		'''
+		sider = siderparser.SIDERParser(self.frequency_scale)
+
+		if self.data_directory is not None:
+			sider.data_directory = self.data_directory
+
+		return sider
+
+	def update(self):
+		'''
+			Ingest the current release of meddra_freq.tsv and meddra_all_se.tsv (the first time, everything is new).
+
+			returns:
+				DICT with the "drug|se" pairs 'added', 'changed' and 'removed' in meddra_freq.tsv, and the drugs
+				whose side-effects changed in meddra_all_se.tsv ('drugs_all_se').
+		'''
+		sider = self.__parser()
+
+		drugs_se = sider.parser_meddra_freq(self.my_preferred_term)
+
+		# diff of meddra_freq.tsv, by drug-se pair.
+		freq_hashes = dict()
+		changed_rows = dict()
+		changes = {'added': list(), 'changed': list(), 'removed': list()}
+
+		for drug_id, side_effects in drugs_se.iteritems():
+			for se, data in side_effects.iteritems():
+				pair = str(drug_id) + '|' + se
+				h = _row_hash((data['placebo'], data['frequency']))
+				freq_hashes[pair] = h
+
+				if self.freq_hashes.get(pair) != h:
+					changes['added' if pair not in self.freq_hashes else 'changed'].append(pair)
+
+					if drug_id not in changed_rows:
+						changed_rows[drug_id] = dict()
+					changed_rows[drug_id][se] = data
+
+		changes['removed'] = [pair for pair in self.freq_hashes if pair not in freq_hashes]
+
+		# diff of meddra_all_se.tsv, by drug.
+		all_se = sider.parser_meddra_all_se(self.my_preferred_term)
+		all_se_hashes = dict((drug, _row_hash(sorted(listse))) for drug, listse in all_se.iteritems())
+		changes['drugs_all_se'] = [drug for drug in set(all_se_hashes) | set(self.all_se_hashes)
+									if all_se_hashes.get(drug) != self.all_se_hashes.get(drug)]
+
+		self.__patch(sider, changed_rows, changes['changed'] + changes['removed'])
+
+		self.freq_hashes = freq_hashes
+		self.all_se_hashes = all_se_hashes
+		self.all_se = all_se
+
+		return changes
+
+	def __patch(self, sider, changed_rows, stale_pairs):
+		'''
+			Recompute the pairs of changed_rows ({drug: {se: data}}, as parser_meddra_freq(...)) and patch the snapshot.
+			stale_pairs: pairs whose previous values are dropped first.
+		'''
+		for pair in stale_pairs:
+			self.pair_means.pop(pair, None)
+
+			drug, se = pair.split('|')
+			self.postmarketing[drug].discard(se)
+
+			if drug in self.sider_with_freq and se in self.sider_with_freq[drug]:
+				del self.sider_with_freq[drug][se]
+				self.se_drug_count[se] -= 1
+
+				if not self.sider_with_freq[drug]:
+					del self.sider_with_freq[drug]
+				if self.se_drug_count[se] == 0:
+					del self.se_drug_count[se]
+
+		self.touched_pairs = list(stale_pairs)
+
+		if not changed_rows:
+			return
+
+		# the pairs are independent all the way: the subset gives the same values as the whole release.
+		drug_se_fingerprint, placeboGroup = sider.preprocessingToFrequencyLabels(sider.se_freq_breakdown(changed_rows), batched = True)
+		DrugSEFilter, AllFrequencies = sider.removepairsInconsistencyFrequency(sider.UnifySets(drug_se_fingerprint), batched = True)
+
+		for pair, values in DrugSEFilter.iteritems():
+			self.pair_means[pair] = values[0]
+			self.touched_pairs.append(pair)
+
+			drug, se = pair.split('|')
+			if drug not in self.sider_with_freq:
+				self.sider_with_freq[drug] = dict()
+
+			self.sider_with_freq[drug][se] = values
+			self.se_drug_count[se] += 1
+
+		# post-marketing only pairs, not yet restricted to the side-effects with frequency.
+		changed_se = set(se for side_effects in changed_rows.itervalues() for se in side_effects)
+		for drug, listse in sider.UnifySetsPostmarketing(drug_se_fingerprint, changed_se).iteritems():
+			self.postmarketing[drug].update(listse)
+
+	def outputs(self):
+		'''
+			returns:
+				sider_with_freq, unique_se_with_freq, sider_pmktg, sider_no_freq
+				(as finalDrugSElist(...), UnifySetsPostmarketing(...) and SideEffectswithNoFrequency(...)).
+		'''
+		unique_se_with_freq = list(self.se_drug_count)
+		unique = set(unique_se_with_freq)
+
+		sider_pmktg = defaultdict(set)
+		for drug, listse in self.postmarketing.iteritems():
+			listse = listse & unique
+			if listse:
+				sider_pmktg[drug] = listse
+
+		sider_no_freq = self.__parser().SideEffectswithNoFrequency(self.all_se, self.sider_with_freq, sider_pmktg, unique_se_with_freq)
+
+		return self.sider_with_freq, unique_se_with_freq, sider_pmktg, sider_no_freq
+
+	def patch_matrix(self, M, my_row_list, my_col_list):
+		'''
+			Update in place a matrix of frequencies (e.g. DoubleDicttoMatrixConstrained(sider_with_freq, ...)) with
+			the pairs of the last update: new values are written and removed pairs set to 0.
+				my_row_list, my_col_list: drugs and side-effects of the rows and columns (or label -> position dicts).
+			Pairs whose drug or side-effect is not in the matrix are skipped.
+
+			returns:
+				number of cells written.
+		'''
+		if isinstance(my_row_list, dict) and isinstance(my_col_list, dict):
+			row_index, column_index = my_row_list, my_col_list
+		else:
+			row_index, column_index = self.utilities.MatrixIndex(list(my_row_list), list(my_col_list))
+
+		written = 0
+		for pair in self.touched_pairs:
+			drug, se = pair.split('|')
+
+			idx1 = row_index.get(drug)
+			idx2 = column_index.get(se)
+			if idx1 is None or idx2 is None:
+				continue
+
+			M[idx1, idx2] = self.pair_means.get(pair, 0)
+			written += 1
+
+		return written
+
+	def save(self, directory = None, variable_name = SNAPSHOT_NAME):
+		'''
+			Save the snapshot (results directory by default).
+		'''
+		if directory is None:
+			directory = self.easyparser.get_results_directory()
+
+		state = dict((k, getattr(self, k)) for k in ('my_preferred_term', 'freq_hashes', 'all_se_hashes', 'pair_means',
+					'postmarketing', 'sider_with_freq', 'se_drug_count', 'all_se'))
+
+		self.easyparser.save_pickle(directory, variable_name, state)
+
+	def load(self, directory = None, variable_name = SNAPSHOT_NAME):
+		'''
+			Load a snapshot saved by save(...).
+		'''
+		if directory is None:
+			directory = self.easyparser.get_results_directory()
+
+		for k, v in self.easyparser.read_pickle(directory, variable_name).iteritems():
+			setattr(self, k, v)
+
+		self.touched_pairs = list()
+
+		return self
@@ -0,0 +1,171 @@
+import array
+import numpy as np
+from collections import defaultdict
+
+import Vocabulary as vocabulary
+
+# Value types, as the keys of the drug_se_pair dicts of SIDERParser.se_freq_breakdown(...).
+VALUE_TYPES = ['exact_freq', 'range_freq', 'label_freq', 'placebo_exact_freq', 'placebo_range_freq']
+EXACT_FREQ, RANGE_FREQ, LABEL_FREQ, PLACEBO_EXACT_FREQ, PLACEBO_RANGE_FREQ = range(len(VALUE_TYPES))
+
+# Set of each value type, as the bits SET_A, SET_B and SET_C of SIDERParser.
+VALUE_TYPE_SETS = [1, 1, 2, 4, 4]
+
+class PairStore(object):
+	"""
+	Columnar store of drug-side effect pairs and their frequency values, instead of a dict keyed by "drug|se"
+	strings with a defaultdict(list) per pair:
+		pair_drug, pair_se: drug and side-effect index of each pair (in self.vocabulary).
+		offsets: the values of pair i are the entries offsets[i] to offsets[i + 1] - 1.
+		value_type, value: one entry per value. Labels are stored as their index in self.labels.
+	Pairs are added with add_pair(...); columns() gives the numpy arrays.
+	"""
+	def __init__(self, vocab = None):
+
+		if vocab is None:
+			vocab = vocabulary.SIDERVocabulary()
+
+		self.vocabulary = vocab
+		self.labels = vocabulary.Vocabulary()
+
+		# compact buffers, moved to numpy arrays by columns().
+		self.__drug = array.array('i')
+		self.__se = array.array('i')
+		self.__offsets = array.array('l', [0])
+		self.__value_type = array.array('b')
+		self.__value = array.array('d')
+
+		self.__columns = None
+
+	def add_pair(self, drug, se, values):
+		'''
+		Add a pair.
+		:param drug: drug ID (stereo ID, int or str).
+		:param se: side-effect name.
+		:param values: list of (value type, value), labels (LABEL_FREQ) as strings.
+		:return: index of the pair.
+		'''
+		self.__drug.append(self.vocabulary.drugs.add(int(drug)))
+		self.__se.append(self.vocabulary.terms.add(se))
+
+		for value_type, value in values:
+			if value_type == LABEL_FREQ:
+				value = self.labels.add(value)
+
+			self.__value_type.append(value_type)
+			self.__value.append(value)
+
+		self.__offsets.append(len(self.__value))
+		self.__columns = None
+
+		return len(self.__drug) - 1
+
+	def add_pair_dict(self, drug_se_pair):
+		'''
+		Add the pairs of a dict with the shape of the output of se_freq_breakdown(...).
+		:return: self
+		'''
+		for pair, fiels in drug_se_pair.iteritems():
+			drug, se = pair.split('|', 1)
+
+			values = list()
+			for value_type, key in enumerate(VALUE_TYPES):
+				if key in fiels:
+					values.extend((value_type, value) for value in fiels[key])
+
+			self.add_pair(drug, se, values)
+
+		return self
+
+	def columns(self):
+		'''
+		:return: pair_drug, pair_se, offsets, value_type, value (numpy arrays).
+		'''
+		if self.__columns is None:
+			self.__columns = (np.array(self.__drug, dtype=np.int32), np.array(self.__se, dtype=np.int32),
+							  np.array(self.__offsets, dtype=np.int64), np.array(self.__value_type, dtype=np.int8),
+							  np.array(self.__value, dtype=float))
+
+		return self.__columns
+
+	def __len__(self):
+
+		return len(self.__drug)
+
+	def pair_key(self, idx):
+		'''
+		"drug|se" key of the pair, as in the dicts of SIDERParser.
+		'''
+		return str(self.vocabulary.drugs.label(self.__drug[idx])) + '|' + self.vocabulary.terms.label(self.__se[idx])
+
+	def pair_keys(self):
+		'''
+		"drug|se" keys of all the pairs.
+		'''
+		return [self.pair_key(idx) for idx in range(len(self))]
+
+	def lengths(self):
+		'''
+		Number of values of each pair.
+		'''
+		return np.diff(self.columns()[2])
+
+	def value_pairs(self):
+		'''
+		Index of the pair of each value.
+		'''
+		return np.repeat(np.arange(len(self)), self.lengths())
+
+	def masks(self):
+		'''
+		Bitmask of the frequency sets (SET_A, SET_B, SET_C) of each pair.
+		:return: numpy array of uint8.
+		'''
+		offsets, value_type = self.columns()[2:4]
+
+		if len(value_type) == 0:
+			return np.zeros(len(self), dtype=np.uint8)
+
+		# bit of each value, or-ed over the values of each pair. The pairs without values are reset after.
+		bits = np.array(VALUE_TYPE_SETS, dtype=np.uint8)[value_type]
+		masks = np.bitwise_or.reduceat(bits, np.minimum(offsets[:-1], len(bits) - 1))
+		masks[offsets[1:] == offsets[:-1]] = 0
+
+		return masks
+
+	def grouped_values(self, value_types):
+		'''
+		Values of the given types, grouped by pair.
+		:param value_types: list of value types, e.g. [EXACT_FREQ, RANGE_FREQ].
+		:return: values (flat array, pairs one after the other), number of values of each pair.
+		'''
+		value_type, value = self.columns()[3:5]
+
+		selected = np.in1d(value_type, value_types)
+		lengths = np.bincount(self.value_pairs()[selected], minlength=len(self))
+
+		return value[selected], lengths
+
+	def to_pair_dict(self):
+		'''
+		Export to the dict shape of se_freq_breakdown(...):
+			key: "drug|se", value: defaultdict(list) with the values of each type.
+		'''
+		pair_drug, pair_se, offsets, value_type, value = self.columns()
+		offsets = offsets.tolist()
+		value_type = value_type.tolist()
+		value = value.tolist()
+
+		drug_se_pair = dict()
+		for idx in range(len(self)):
+			fiels = defaultdict(list)
+
+			for v in range(offsets[idx], offsets[idx + 1]):
+				if value_type[v] == LABEL_FREQ:
+					fiels[VALUE_TYPES[LABEL_FREQ]].append(self.labels.label(int(value[v])))
+				else:
+					fiels[VALUE_TYPES[value_type[v]]].append(value[v])
+
+			drug_se_pair[self.pair_key(idx)] = fiels
+
+		return drug_se_pair
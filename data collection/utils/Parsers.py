@@ -1,12 +1,53 @@
+import bz2
+import contextlib
+import cPickle
 import csv
+import gzip
+import io
 import os
-import pickle
-import numpy, scipy.io
+import struct
+import uuid
+import zipfile
+import numpy, scipy.io, scipy.sparse
 from collections import defaultdict
 __author__ = 'diegogaleano'
 __email__  = 'Diego.Galeano.2014@rhul.live.ac.uk'
 __date__  = '19-10-2016'
 
+# Magic numbers of the compressed formats that open_file can stream.
+COMPRESSED_MAGIC = [('\x1f\x8b', '.gz'), ('BZh', '.bz2'), ('\xfd7zXZ\x00', '.xz')]
+
+# Read buffer used when decompressing, large enough to amortize the decoder calls.
+READ_BUFFER_SIZE = 1 << 20
+
+# save_pickle keeps the numpy arrays of at least this size out of the pickle, in .npy files of this folder.
+OUT_OF_BAND_MIN_BYTES = 1 << 16
+ARRAYS_SUFFIX = '.arrays'
+
+@contextlib.contextmanager
+def atomic_write(path):
+	'''
+	Open a temporary file next to path for writing (binary); when the block ends without error it is renamed
+	to path, so a crash never leaves a half-written file. The file gets the usual permissions (umask).
+	:param path:
+	:return: context manager giving the file object.
+	'''
+	# created as open() does (mode 0666 minus the umask), unlike tempfile.mkstemp (0600).
+	temp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+	fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0666)
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			yield f
+
+		# os.rename does not replace an existing file on Windows.
+		if os.name == 'nt' and os.path.exists(path):
+			os.remove(path)
+		os.rename(temp, path)
+	except:
+		if os.path.exists(temp):
+			os.remove(temp)
+		raise
+
 class EasyParsers(object):
 	"""
 	Broad class that parser different types of files.
@@ -59,30 +100,148 @@ class EasyParsers(object):
 
 		return result_dir
 		
-	def parse_csv(self, filename, quote = '|'):
+	def find_data_file(self, filename):
 		'''
-		Parse the csv file in plain way.
-		:return: list
+		Return the path of filename, or of its compressed release (.gz, .bz2, .xz) if only that one exists.
+		:param filename: path of the uncompressed file.
+		:return: path of the file to read.
+		'''
+		if os.path.exists(filename):
+			return filename
+
+		for magic, extension in COMPRESSED_MAGIC:
+			if os.path.exists(filename + extension):
+				return filename + extension
+
+		return filename
+
+	def compression(self, filename):
 		'''
-		data = list()
-		with open(filename, 'rb') as csvfile:
+		Compression format of the file, detected from its magic number.
+		:param filename:
+		:return: '.gz', '.bz2', '.xz', or None for a plain file.
+		'''
+		with open(filename, 'rb') as f:
+			magic = f.read(6)
+
+		for prefix, extension in COMPRESSED_MAGIC:
+			if magic.startswith(prefix):
+				return extension
+
+		return None
+
+	def open_file(self, filename):
+		'''
+		Open the file for reading in binary mode. gzip, bz2 and xz files are detected by their
+		magic number and decompressed on the fly, in large blocks.
+		:param filename:
+		:return: file object.
+		'''
+		extension = self.compression(filename)
+
+		if extension == '.gz':
+			return io.BufferedReader(gzip.GzipFile(filename, 'rb'), READ_BUFFER_SIZE)
+
+		if extension == '.bz2':
+			return bz2.BZ2File(filename, 'rb', READ_BUFFER_SIZE)
+
+		if extension == '.xz':
+			try:
+				import lzma
+			except ImportError:
+				from backports import lzma
+			return io.BufferedReader(lzma.LZMAFile(filename, 'rb'), READ_BUFFER_SIZE)
+
+		return open(filename, 'rb', READ_BUFFER_SIZE)
+
+	def tsv_chunks(self, filename, n_chunks):
+		'''
+		Split the file into byte ranges that start and end on line boundaries, so that each range
+		can be parsed on its own (see iter_tsv). Compressed files cannot be split: a single range
+		covering the whole file is returned.
+		:param n_chunks: number of ranges wanted (fewer are returned for small files).
+		:return: list of (start, end) tuples, end = None means until the end of the file.
+		'''
+		if n_chunks <= 1 or self.compression(filename) is not None:
+			return [(0, None)]
+
+		size = os.path.getsize(filename)
+		boundaries = [0]
+
+		with open(filename, 'rb') as f:
+			for i in range(1, n_chunks):
+				# the chunk starts after the end of the line that contains the split point.
+				f.seek(max(size * i // n_chunks - 1, boundaries[-1]))
+				f.readline()
+				position = f.tell()
+
+				if boundaries[-1] < position < size:
+					boundaries.append(position)
+
+		boundaries.append(None)
+
+		return list(zip(boundaries[:-1], boundaries[1:]))
+
+	def __iter_lines(self, f, byte_range):
+		'''
+		Lines of the open file that start inside the byte range.
+		'''
+		start, end = byte_range
+		f.seek(start)
+		position = start
+
+		while end is None or position < end:
+			line = f.readline()
+			if not line:
+				break
+			position += len(line)
+			yield line
+
+	def iter_csv(self, filename, quote = '|'):
+		'''
+		Iterate over the rows of the csv file, one at a time.
+		The file is never held in memory as a whole. Compressed files are read transparently.
+		:return: generator of lists
+		'''
+		with self.open_file(filename) as csvfile:
 			spamreader = csv.reader(csvfile, delimiter=',', quotechar=quote)
 			for row in spamreader:
-				data.append(row)
+				yield row
 
-		return data
+	def iter_tsv(self, filename, must_contain = None, byte_range = None):
+		'''
+		Iterate over the rows of the tsv file, one at a time.
+		The file is never held in memory as a whole. Compressed files are read transparently.
+		:param must_contain: if given, lines that do not contain this string are skipped before
+			they are split into fields (e.g. '\tPT\t' to keep only one term type).
+		:param byte_range: (start, end) from tsv_chunks, to read only that part of the file.
+		:return: generator of lists
+		'''
+		with self.open_file(filename) as tsvfile:
+			lines = tsvfile
+			if byte_range is not None and byte_range != (0, None):
+				lines = self.__iter_lines(tsvfile, byte_range)
+
+			if must_contain is not None:
+				lines = (line for line in lines if must_contain in line)
+
+			spamreader = csv.reader(lines, delimiter='\t')
+			for row in spamreader:
+				yield row
+
+	def parse_csv(self, filename, quote = '|'):
+		'''
+		Parse the csv file in plain way.
+		:return: list
+		'''
+		return list(self.iter_csv(filename, quote))
 
 	def parse_tsv(self, filename):
 		'''
 		Parse the tsv file in plain way.
 		:return: list
 		'''
-		data = list()
-		with open(filename, 'rb') as tsvfile:
-			spamreader = csv.reader(tsvfile, delimiter='\t')
-			for row in spamreader:
-				data.append(row)
-		return data
+		return list(self.iter_tsv(filename))
 
 	def parse_csv_header(self, filename, column_id = 0):
 		'''
@@ -134,62 +293,226 @@ class EasyParsers(object):
 
 		return my_dict
 
-	def save_pickle(self, directory,variable_name, variable):
+	def save_pickle(self, directory,variable_name, variable, compress = False, out_of_band = True):
 		'''
-		Save the data in pickle format.
+		Save the data in pickle format (highest protocol). The file is written to a temporary file first and then
+		renamed, so a crash never leaves a half-written file.
 		:param variable_name:
 		:param variable:
+		:param compress: gzip the pickle (level 1, fast).
+		:param out_of_band: numpy arrays (of at least OUT_OF_BAND_MIN_BYTES) are saved as .npy files in the
+			folder variable_name + '.arrays/', so read_pickle can memory-map them.
 		:return:
 		'''
-		output = open(directory + variable_name, 'wb')
-		pickle.dump(variable, output)
-		output.close()
+		path = directory + variable_name
+		arrays_dir = path + ARRAYS_SUFFIX
+		# the arrays of each save get their own names: the previous pickle stays valid until it is replaced.
+		token = uuid.uuid4().hex
+		saved_arrays = list()
+		# id(array) -> (array, name): the persistent IDs skip the pickle memo, an array referenced twice is saved
+		# once and loaded back as one array. The array is kept so that its id is not reused.
+		memo = dict()
+
+		def persistent_id(obj):
+			# subclasses (masked arrays, matrices) go through the normal pickle path, which keeps their type.
+			if type(obj) is numpy.ndarray and obj.dtype != object and obj.nbytes >= OUT_OF_BAND_MIN_BYTES:
+				if id(obj) in memo:
+					return memo[id(obj)][1]
+
+				if not os.path.isdir(arrays_dir):
+					os.makedirs(arrays_dir)
+
+				name = '%s_%d.npy' % (token, len(saved_arrays))
+				numpy.save(os.path.join(arrays_dir, name), obj)
+				saved_arrays.append(name)
+				memo[id(obj)] = (obj, name)
+				return name
 
-	def save_matlab(self, directory,variable_name, variable):
+			return None
+
+		try:
+			with atomic_write(path) as output:
+				if compress:
+					output = gzip.GzipFile(fileobj=output, mode='wb', compresslevel=1)
+
+				pickler = cPickle.Pickler(output, cPickle.HIGHEST_PROTOCOL)
+				if out_of_band:
+					# only called for the objects that are not builtin types (the arrays among them).
+					pickler.inst_persistent_id = persistent_id
+				pickler.dump(variable)
+
+				if compress:
+					output.close()
+		except:
+			for name in saved_arrays:
+				os.remove(os.path.join(arrays_dir, name))
+			raise
+
+		# arrays of the previous saves.
+		if os.path.isdir(arrays_dir):
+			for name in os.listdir(arrays_dir):
+				if name not in saved_arrays:
+					os.remove(os.path.join(arrays_dir, name))
+
+	def save_matlab(self, directory,variable_name, variable, sparse = False):
 		'''
-		Save the data in .mat format.
+		Save the data in .mat format. scipy.sparse matrices are written as MATLAB sparse variables.
 		:param variable_name:
 		:param variable:
+		:param sparse: write a dense matrix as a sparse variable (only its non zero entries are stored).
 		:return:
 		'''
+		if sparse and isinstance(variable, numpy.ndarray) and variable.ndim == 2:
+			variable = scipy.sparse.csc_matrix(variable)
+
 		scipy.io.savemat(directory + variable_name,mdict ={variable_name: variable})
 
-	def read_pickle(self,directory, variable_name):
+	def save_matrix(self, directory, variable_name, matrix, row_labels = None, column_labels = None):
+		'''
+		Save a matrix (e.g. built by MyUtilities) for fast reloads with load_matrix:
+			dense: variable_name + '.npy'.
+			scipy.sparse: variable_name + '.npz', CSR, uncompressed (as scipy.sparse.save_npz(..., compressed=False)).
+		The labels of the rows and columns go to variable_name + '.rows.txt' and '.cols.txt', one per line.
+		:param matrix:
+		:param row_labels: list (e.g. the rows returned by DoubleDicttoMatrix).
+		:param column_labels: list.
+		:return:
+		'''
+		path = directory + variable_name
+
+		if scipy.sparse.issparse(matrix):
+			matrix = matrix.tocsr()
+			numpy.savez(path + '.npz', data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+						shape=numpy.array(matrix.shape), format=numpy.array(b'csr'))
+		else:
+			numpy.save(path + '.npy', numpy.asarray(matrix))
+
+		for labels, extension in ((row_labels, '.rows.txt'), (column_labels, '.cols.txt')):
+			if labels is not None:
+				with open(path + extension, 'wb') as f:
+					for label in labels:
+						f.write(str(label) + '\n')
+
+	def load_matrix(self, directory, variable_name, mmap_mode = 'r'):
+		'''
+		Load a matrix saved by save_matrix. With mmap_mode the arrays are memory-mapped, without copying them
+		(also the arrays of the sparse matrices, stored uncompressed in the .npz).
+		:param mmap_mode: None to read the arrays in memory.
+		:return: matrix, row labels, column labels (None if they were not saved).
+		'''
+		path = directory + variable_name
+
+		if os.path.exists(path + '.npz'):
+			arrays = dict()
+			for name in ('data', 'indices', 'indptr', 'shape'):
+				arrays[name] = self.__load_npz_member(path + '.npz', name, mmap_mode)
+
+			matrix = scipy.sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+											 shape=tuple(arrays['shape']), copy=False)
+		else:
+			matrix = numpy.load(path + '.npy', mmap_mode=mmap_mode)
+
+		labels = list()
+		for extension in ('.rows.txt', '.cols.txt'):
+			if os.path.exists(path + extension):
+				with open(path + extension, 'rb') as f:
+					labels.append(f.read().splitlines())
+			else:
+				labels.append(None)
+
+		return matrix, labels[0], labels[1]
+
+	def __load_npz_member(self, filename, name, mmap_mode):
+		'''
+		Array name of the .npz file, memory-mapped if mmap_mode is given and the member is not compressed.
+		'''
+		with zipfile.ZipFile(filename) as archive:
+			info = archive.getinfo(name + '.npy')
+
+		if mmap_mode is None or info.compress_type != zipfile.ZIP_STORED:
+			return numpy.load(filename)[name]
+
+		with open(filename, 'rb') as f:
+			# the array starts after the local header of the member: 30 bytes, the name and the extra field.
+			f.seek(info.header_offset + 26)
+			name_length, extra_length = struct.unpack('<HH', f.read(4))
+			f.seek(info.header_offset + 30 + name_length + extra_length)
+
+			version = numpy.lib.format.read_magic(f)
+			if version == (1, 0):
+				shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(f)
+			else:
+				shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(f)
+			offset = f.tell()
+
+		return numpy.memmap(filename, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape,
+							order='F' if fortran_order else 'C')
+
+	def read_pickle(self,directory, variable_name, mmap_mode = None):
 		'''
-		Read pickle files
+		Read pickle files (compressed or not, see save_pickle).
 		:param variable_name:
+		:param mmap_mode: mode used to open the out of band numpy arrays, e.g. 'r' to memory-map them.
 		:return: data.
 		'''
-		pkl_file = open(directory + variable_name, 'rb')
-		data = pickle.load(pkl_file)
+		path = directory + variable_name
+		arrays_dir = path + ARRAYS_SUFFIX
+
+		# each file is loaded once, the references to the same array stay shared.
+		arrays = dict()
+
+		def persistent_load(name):
+			if name not in arrays:
+				arrays[name] = numpy.load(os.path.join(arrays_dir, name), mmap_mode=mmap_mode)
+			return arrays[name]
+
+		with self.open_file(path) as pkl_file:
+			unpickler = cPickle.Unpickler(pkl_file)
+			unpickler.persistent_load = persistent_load
+			data = unpickler.load()
+
 		return data
 
-	def features_dictionary_to_npmatrix(self, my_dict, list_order, list_features, list_fcfp):
+	def features_dictionary_to_npmatrix(self, my_dict, list_order, list_features, list_fcfp, sparse_fcfp = False):
 		'''
 		Convert a dictionary into a np matrix according to the list that states the order of the indexes.
 		Only will take the features indicated in list_features.
+		The FCFP block is filled from the bits present in each compound only, through a bit -> column index.
 		:param my_dict:
 		:param list_order:
 		:param list_features
+		:param list_fcfp
+		:param sparse_fcfp: return the FCFP block as a scipy.sparse CSR matrix (for large fingerprint vocabularies).
 		:return:
 		'''
 		Nfeatures = len(list_features)
 		Ndata = len(list_order)
 		Nfcfp = len(list_fcfp)
-		MatrixF1 = numpy.zeros(shape=(Ndata, Nfeatures))
-		MatrixF2 = numpy.zeros(shape=(Ndata, Nfcfp))
+
+		MatrixF1 = numpy.array([[my_dict[k][f] for f in list_features] for k in list_order], dtype=float)
+		MatrixF1 = MatrixF1.reshape((Ndata, Nfeatures))
+
+		fcfp_index = dict((f, idy) for idy, f in enumerate(list_fcfp))
+		rows = list()
+		cols = list()
+		values = list()
 
 		for idx, k in enumerate(list_order):
-			for idy, f in enumerate(list_features):
-				MatrixF1[idx][idy] = my_dict[k][f]
+			for f, v in my_dict[k]['fcfp'].iteritems():
+				idy = fcfp_index.get(f)
+				if idy is not None:
+					rows.append(idx)
+					cols.append(idy)
+					values.append(v)
 
-			for idy, f in enumerate(list_fcfp):
-				if f in my_dict[k]['fcfp']:
-					MatrixF2[idx][idy] = my_dict[k]['fcfp'][f]
+		if sparse_fcfp:
+			MatrixF2 = scipy.sparse.csr_matrix((numpy.array(values, dtype=float), (rows, cols)), shape=(Ndata, Nfcfp))
+		else:
+			MatrixF2 = numpy.zeros(shape=(Ndata, Nfcfp))
+			MatrixF2[rows, cols] = values
 
 		return MatrixF1, MatrixF2
 
-
 	 
 
 	#if __name__ == '__main__':
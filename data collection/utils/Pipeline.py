@@ -0,0 +1,144 @@
+import Queue
+import sys
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+# A stage: function is called with the outputs of the stages in inputs, in that order.
+Stage = namedtuple('Stage', ['name', 'function', 'inputs'])
+
+class Pipeline(object):
+	"""
+	Lazy runner of a graph of stages. run(outputs) computes only the stages the requested outputs depend on,
+	runs the stages whose inputs are ready in a thread pool (so independent branches, e.g. the indications and
+	the frequency chain, overlap), and drops each intermediate output as soon as no pending stage needs it.
+	"""
+	def __init__(self):
+
+		self.stages = dict()
+
+	def add(self, name, function, inputs = ()):
+		'''
+		Declare a stage.
+		:param name: name of the output.
+		:param function: called with the outputs of inputs.
+		:param inputs: names of the stages it depends on (they can be declared later).
+		:return: self
+		'''
+		if name in self.stages:
+			raise ValueError('Stage %s is already declared.' % name)
+
+		self.stages[name] = Stage(name, function, tuple(inputs))
+
+		return self
+
+	def dependencies(self, outputs):
+		'''
+		Stages needed to compute outputs (including them).
+		:return: set of names.
+		'''
+		needed = set()
+		pending = list(outputs)
+
+		while pending:
+			name = pending.pop()
+			if name in needed:
+				continue
+
+			if name not in self.stages:
+				raise KeyError('Unknown stage: %s' % name)
+
+			needed.add(name)
+			pending.extend(self.stages[name].inputs)
+
+		return needed
+
+	def run(self, outputs, n_threads = None):
+		'''
+		:param outputs: names of the outputs wanted.
+		:param n_threads: size of the thread pool (None = one per stage that can run at the same time).
+		:return: dict name -> output, with the requested outputs only.
+		'''
+		needed = self.dependencies(outputs)
+		self.__check_cycles(needed)
+
+		# number of pending stages (and requests) that still need each output.
+		consumers = dict((name, 0) for name in needed)
+		for name in needed:
+			for i in self.stages[name].inputs:
+				consumers[i] += 1
+		for name in outputs:
+			consumers[name] += 1
+
+		missing = dict((name, len(set(self.stages[name].inputs))) for name in needed)
+		results = dict()
+		done = Queue.Queue()
+
+		if n_threads is None:
+			n_threads = max(len(needed), 1)
+
+		pool = ThreadPool(n_threads)
+		try:
+			for name in needed:
+				if missing[name] == 0:
+					self.__submit(pool, done, name, [])
+
+			finished = 0
+			while finished < len(needed):
+				name, ok, value = done.get()
+				if not ok:
+					# the error of the stage, with its traceback.
+					raise value[0], value[1], value[2]
+
+				finished += 1
+				results[name] = value
+
+				# release the inputs nobody else needs.
+				for i in self.stages[name].inputs:
+					consumers[i] -= 1
+					if consumers[i] == 0:
+						del results[i]
+
+				for other in needed:
+					if other not in results and missing[other] > 0 and name in self.stages[other].inputs:
+						missing[other] -= 1
+						if missing[other] == 0:
+							self.__submit(pool, done, other, [results[i] for i in self.stages[other].inputs])
+		finally:
+			pool.terminate()
+			pool.join()
+
+		return dict((name, results[name]) for name in outputs)
+
+	def __submit(self, pool, done, name, args):
+		'''
+		Run the stage in the pool; its output (or its error) is put in done.
+		'''
+		function = self.stages[name].function
+
+		def call():
+			try:
+				done.put((name, True, function(*args)))
+			except Exception:
+				done.put((name, False, sys.exc_info()))
+
+		pool.apply_async(call)
+
+	def __check_cycles(self, needed):
+		'''
+		Raise ValueError if the stages depend on each other in a cycle.
+		'''
+		state = dict()
+
+		def visit(name, path):
+			if state.get(name) == 'done':
+				return
+			if state.get(name) == 'visiting':
+				raise ValueError('Cycle between the stages: %s' % ' -> '.join(path + [name]))
+
+			state[name] = 'visiting'
+			for i in self.stages[name].inputs:
+				visit(i, path + [name])
+			state[name] = 'done'
+
+		for name in needed:
+			visit(name, [])
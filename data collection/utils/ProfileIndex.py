@@ -0,0 +1,212 @@
+import bisect
+import threading
+from collections import defaultdict, OrderedDict
+
+# Number of query results kept by ProfileIndex.
+QUERY_CACHE_SIZE = 1024
+
+class ProfileIndex(object):
+	"""
+	In-memory index of the final outputs of SIDERParser, for repeated interactive queries:
+		forward: drug -> [(side-effect, score)], from the highest score.
+		inverted: side-effect -> posting list [(drug, score)], from the highest score.
+	plus the post-marketing side-effects and the indications of each drug (and their inverted mappings).
+	Thresholds on the score are a binary search in the sorted posting lists. The results of the last queries
+	are kept in an LRU cache; they are returned as tuples and frozensets, so they can be shared.
+	"""
+	def __init__(self, sider_with_freq, sider_pmktg = None, sider_ind = None, cache_size = QUERY_CACHE_SIZE):
+		'''
+		:param sider_with_freq: drug_se_profile of finalDrugSElist(...), {drug: {se: [score]}}.
+		:param sider_pmktg: output of UnifySetsPostmarketing(...).
+		:param sider_ind: output of parser_all_indications(...).
+		:param cache_size: number of query results kept.
+		'''
+		self.forward = dict()
+		inverted = defaultdict(list)
+		# negated scores of each posting list, increasing, for the bisect of the thresholds.
+		self.__forward_neg_scores = dict()
+		self.__neg_scores = dict()
+
+		for drug, side_effects in sider_with_freq.iteritems():
+			postings = sorted(((se, values[0]) for se, values in side_effects.iteritems()), key=lambda p: (-p[1], p[0]))
+			self.forward[drug] = tuple(postings)
+			self.__forward_neg_scores[drug] = [-score for se, score in postings]
+
+			for se, score in postings:
+				inverted[se].append((drug, score))
+
+		self.inverted = dict()
+		for se, postings in inverted.iteritems():
+			postings.sort(key=lambda p: (-p[1], p[0]))
+			self.inverted[se] = tuple(postings)
+			self.__neg_scores[se] = [-score for drug, score in postings]
+
+		self.postmarketing, self.postmarketing_inverted = self.__set_mappings(sider_pmktg)
+		self.indications, self.indications_inverted = self.__set_mappings(sider_ind)
+
+		self.cache_size = cache_size
+		self.__cache = OrderedDict()
+		# the queries can come from several threads (e.g. a dashboard server).
+		self.__lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def __set_mappings(self, drug_dict):
+		'''
+		drug -> frozenset(terms) and term -> frozenset(drugs) of a dict {drug: set(terms)}.
+		'''
+		forward = dict()
+		inverted = defaultdict(set)
+
+		for drug, terms in (drug_dict or {}).iteritems():
+			forward[drug] = frozenset(terms)
+			for term in terms:
+				inverted[term].add(drug)
+
+		return forward, dict((term, frozenset(drugs)) for term, drugs in inverted.iteritems())
+
+	def __cached(self, key, compute):
+		'''
+		Result of the query key, from the LRU cache or compute(). compute() runs outside the lock, so a slow
+		query does not block the others (two threads may compute the same result, both are equal).
+		'''
+		with self.__lock:
+			if key in self.__cache:
+				self.hits += 1
+				value = self.__cache.pop(key)
+				self.__cache[key] = value
+				return value
+
+			self.misses += 1
+
+		value = compute()
+
+		with self.__lock:
+			self.__cache.pop(key, None)
+			self.__cache[key] = value
+
+			while len(self.__cache) > self.cache_size:
+				self.__cache.popitem(last=False)
+
+		return value
+
+	def clear_cache(self):
+
+		with self.__lock:
+			self.__cache.clear()
+
+	def __threshold(self, postings, neg_scores, min_score, max_score):
+		'''
+		Postings (sorted from the highest score) with min_score <= score <= max_score, by binary search.
+		'''
+		start = 0 if max_score is None else bisect.bisect_left(neg_scores, -max_score)
+		end = len(postings) if min_score is None else bisect.bisect_right(neg_scores, -min_score)
+
+		return postings[start:end]
+
+	def drugs_with(self, side_effect, min_score = None, max_score = None):
+		'''
+		Posting list of the side-effect, optionally with min_score <= score <= max_score.
+		:return: tuple of (drug, score), from the highest score.
+		'''
+		def compute():
+			return self.__threshold(self.inverted.get(side_effect, ()), self.__neg_scores.get(side_effect, []),
+									min_score, max_score)
+
+		return self.__cached(('drugs_with', side_effect, min_score, max_score), compute)
+
+	def side_effects_of(self, drug, min_score = None, max_score = None):
+		'''
+		Side-effects of the drug, optionally with min_score <= score <= max_score.
+		:return: tuple of (side-effect, score), from the highest score.
+		'''
+		def compute():
+			return self.__threshold(self.forward.get(drug, ()), self.__forward_neg_scores.get(drug, []),
+									min_score, max_score)
+
+		return self.__cached(('side_effects_of', drug, min_score, max_score), compute)
+
+	def __drug_set(self, side_effect, min_score):
+
+		return frozenset(drug for drug, score in self.drugs_with(side_effect, min_score))
+
+	def __side_effect_set(self, drug, min_score):
+
+		return frozenset(se for se, score in self.side_effects_of(drug, min_score))
+
+	def __combine(self, sets, operation):
+		'''
+		Intersection or union of the sets, the intersection from the smallest set.
+		'''
+		if not sets:
+			return frozenset()
+
+		if operation == 'and':
+			sets = sorted(sets, key=len)
+			result = set(sets[0])
+			for other in sets[1:]:
+				result.intersection_update(other)
+				if not result:
+					break
+		else:
+			result = set()
+			for other in sets:
+				result.update(other)
+
+		return frozenset(result)
+
+	def drugs_with_all(self, side_effects, min_score = None):
+		'''
+		Drugs that have all the side-effects (with score >= min_score).
+		:return: frozenset
+		'''
+		side_effects = tuple(sorted(set(side_effects)))
+
+		return self.__cached(('drugs_with_all', side_effects, min_score),
+			lambda: self.__combine([self.__drug_set(se, min_score) for se in side_effects], 'and'))
+
+	def drugs_with_any(self, side_effects, min_score = None):
+		'''
+		Drugs that have at least one of the side-effects (with score >= min_score).
+		:return: frozenset
+		'''
+		side_effects = tuple(sorted(set(side_effects)))
+
+		return self.__cached(('drugs_with_any', side_effects, min_score),
+			lambda: self.__combine([self.__drug_set(se, min_score) for se in side_effects], 'or'))
+
+	def shared_side_effects(self, drugs, min_score = None):
+		'''
+		Side-effects shared by all the drugs (with score >= min_score).
+		:return: frozenset
+		'''
+		drugs = tuple(sorted(set(drugs)))
+
+		return self.__cached(('shared_side_effects', drugs, min_score),
+			lambda: self.__combine([self.__side_effect_set(drug, min_score) for drug in drugs], 'and'))
+
+	def any_side_effects(self, drugs, min_score = None):
+		'''
+		Side-effects of at least one of the drugs (with score >= min_score).
+		:return: frozenset
+		'''
+		drugs = tuple(sorted(set(drugs)))
+
+		return self.__cached(('any_side_effects', drugs, min_score),
+			lambda: self.__combine([self.__side_effect_set(drug, min_score) for drug in drugs], 'or'))
+
+	def postmarketing_drugs(self, side_effect):
+		'''
+		Drugs with the side-effect in post-marketing.
+		'''
+		return self.postmarketing_inverted.get(side_effect, frozenset())
+
+	def indication_drugs(self, indications, operation = 'and'):
+		'''
+		Drugs with all ('and') or any ('or') of the indications.
+		:return: frozenset
+		'''
+		indications = tuple(sorted(set(indications)))
+
+		return self.__cached(('indication_drugs', indications, operation),
+			lambda: self.__combine([self.indications_inverted.get(term, frozenset()) for term in indications], operation))
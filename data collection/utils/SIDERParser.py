@@ -4,6 +4,14 @@ import os,sys
 sys.path.insert(0, os.getcwd() + '/utils/')
 
 import Parsers as parsers
+import Utilities as utilities
+import Vocabulary as vocabulary
+import FrequencyParser as frequencyparser
+import WHOScale as whoscale
+import PairStore as pairstore
+import BitMatrix as bitmatrix
+import StageCache as stagecache
+import Pipeline as pipeline
 import pickle
 import numpy, scipy.io
 from xml.etree.ElementTree import iterparse
@@ -13,22 +21,177 @@ from matplotlib import pyplot as plt
 import numpy as np
 from matplotlib_venn import venn3, venn3_circles
 from collections import Counter
+from itertools import chain, izip
+from multiprocessing import Pool, cpu_count
 
 __author__ = 'diegogaleano'
 __email__  = 'Diego.Galeano.2014@rhul.live.ac.uk'
 __date__  = '04-03-2017'
 
+# Frequency types of a drug-se pair, as bits (see SIDERParser.FrequencyTypeMasks).
+SET_A = 1 # exact_freq or range_freq
+SET_B = 2 # label_freq
+SET_C = 4 # placebo_exact_freq or placebo_range_freq
+
+def _ingest_meddra_all_se_file(filename, vocab = None):
+	'''
+		Single pass over meddra_all_se.tsv, see SIDERParser.__ingest_meddra_all_se(...).
+		vocab: SIDERVocabulary used to normalize the names (a new one if None).
+	'''
+	if vocab is None:
+		vocab = vocabulary.SIDERVocabulary()
+	
+	# get all the side-effects
+	selist = parsers.EasyParsers().iter_tsv(filename)
+	
+	drugs_se_by_term = dict()
+	drugID = dict()
+	
+	for row in selist:
+	    # the stereo ID is equivalent to PubChem ID
+		drug_id = int(row[1][3::])
+		
+		flat_id = int(row[0][4::])
+		
+		drugID[flat_id] = drug_id
+		
+		# term type: LLT or PT
+		termtype = row[3]
+		
+		if termtype not in drugs_se_by_term:
+			drugs_se_by_term[termtype] = defaultdict(set)
+		
+		# side-effect
+		se = vocab.term(row[5])
+		
+		drugs_se_by_term[termtype][str(drug_id)].add(se)
+	
+	return drugs_se_by_term, drugID
+	
+def _parse_all_indications_file(filename, my_preferred_term, vocab = None):
+	'''
+		Text mention indications in meddra_all_indications.tsv.
+			dict:
+				key: flat id, value: set of indications.
+	'''
+	if vocab is None:
+		vocab = vocabulary.SIDERVocabulary()
+	
+	# get all the side-effects. Rows of other term types are dropped on the raw line, before splitting it.
+	indicationlist = parsers.EasyParsers().iter_tsv(filename, '\t' + my_preferred_term + '\t')
+	
+	flat_indications = defaultdict(set)
+	
+	for row in indicationlist:
+	    # flat drug ID 
+		flat_id = int(row[0][4::])
+		
+		#indication
+		myindication = vocab.term(row[6])
+		
+		# term type: LLT or PT
+		termtype = row[4]
+		
+		# only if it was text mention
+		if my_preferred_term == termtype:
+			if 'text_mention' in row[2].strip():
+				flat_indications[flat_id].add(myindication)
+	
+	return flat_indications
+	
+def _parse_meddra_freq_rows(selist, my_preferred_term, vocab = None):
+	'''
+		Rows of meddra_freq.tsv to the dict returned by SIDERParser.parser_meddra_freq(...).
+		Module level so that worker processes can run it.
+	'''
+	if vocab is None:
+		vocab = vocabulary.SIDERVocabulary()
+	
+	# get the stitch CID (PubChem ID)
+	drugs_se = defaultdict()
+	
+	for row in selist:
+		# term type: LLT or PT
+		termtype = row[7]
+		
+		if my_preferred_term != termtype:
+			continue
+		
+	    # the stereo ID is equivalent to PubChem ID
+		drug_id = int(row[1][3::])
+		
+		# placebo, otherwise ''
+		placebo = row[3] == 'placebo'
+		
+		# frequency of the side-effect 
+		frequency = row[4]
+
+		# side-effect
+		se = vocab.term(row[9])
+		
+		if drug_id not in drugs_se:
+			drugs_se[drug_id] = dict()
+		
+		if se not in drugs_se[drug_id]:
+			drugs_se[drug_id][se] = defaultdict(list)
+			
+		drugs_se[drug_id][se]['placebo'].append(placebo)
+		drugs_se[drug_id][se]['frequency'].append(frequency)
+			
+	return drugs_se
+	
+def _parse_meddra_freq_chunk(args):
+	'''
+		Parse one byte range of meddra_freq.tsv, args = (filename, my_preferred_term, byte_range).
+	'''
+	filename, my_preferred_term, byte_range = args
+	
+	selist = parsers.EasyParsers().iter_tsv(filename, '\t' + my_preferred_term + '\t', byte_range)
+	
+	return _parse_meddra_freq_rows(selist, my_preferred_term)
+
 class SIDERParser(object):
 	'''
 	 Here we parser the files from SIDER: database for side-effects
 	'''
-	def __init__(self):
+	def __init__(self, frequency_scale = None):
+		'''
+			frequency_scale: WHOScale.WHOFrequencyScale used to map frequencies to WHO labels and scores.
+				The default one uses the WHO thresholds (0.01%, 0.1%, 1%, 10%).
+		'''
 		
 		# Get the default directories
 		self.easyparser = parsers.EasyParsers()
 		self.data_directory = self.easyparser.get_data_directory()
 		self.result_directory = self.easyparser.get_results_directory()
+		self.utilities = utilities.MyUtilities()
+		
+		# meddra_all_se.tsv is ingested once and shared by all the parsers that need it.
+		self.__all_se = None
+		
+		# Drugs and MedDRA terms to integer IDs (see Vocabulary.py), shared by all the outputs.
+		self.vocabulary = vocabulary.SIDERVocabulary()
+		
+		# Frequency descriptions ("1-5%", "common", ...) are parsed once and cached.
+		self.frequency_parser = frequencyparser.FrequencyParser(self.__NormalizeFrequencyLabels)
+		# se_freq_breakdown entries of each description: drug ones [False] and placebo ones [True].
+		self.__frequency_entries = [dict(), dict()]
+		
+		# frequency (%) -> WHO label -> score (1 to 5).
+		if frequency_scale is None:
+			frequency_scale = whoscale.WHOFrequencyScale()
+		self.frequency_scale = frequency_scale
+		
+		# on-disk cache of the stage outputs, created on first use (see cached_stage).
+		self.stage_cache = None
 	
+	def __data_file(self, filename):
+		'''
+			Path of a SIDER file in the data directory. The compressed release (e.g. meddra_freq.tsv.gz)
+			is used when the uncompressed file is not there.
+		'''
+		return self.easyparser.find_data_file(self.data_directory + filename)
+		
 	def parser_meddra_all_se(self, my_preferred_term = 'PT'):
 		'''
 		Description of the file in the README:
@@ -56,32 +219,39 @@ class SIDERParser(object):
 		344     PT      C0235431        Blood creatinine increased
 
 		The mapping was performed by extracting the LLT-->PT relations from UMLS. 
+		
+		The file is read once for all the term types (see __ingest_meddra_all_se); the returned
+		dict is shared between calls, so do not modify it in place.
 
 		'''
 		
 		
-		# get all the side-effects
-		selist = self.easyparser.parse_tsv(self.data_directory + 'meddra_all_se.tsv')
+		# get all the side-effects, for every term type (single pass over the file).
+		drugs_se_by_term, flat_to_stereo = self.__ingest_meddra_all_se()
 		
-		# get the stitch CID (PubChem ID)
-		drugs_se = defaultdict(set)
+		if my_preferred_term not in drugs_se_by_term:
+			return defaultdict(set)
 		
-		for row in selist:
-		    # the stereo ID is equivalent to PubChem ID
-			drug_id = int(row[1][3::])
-			
-			# term type: LLT or PT
-			termtype = row[3]		
+		return drugs_se_by_term[my_preferred_term]
+		
+	def __ingest_meddra_all_se(self):
+		'''
+			Single pass over meddra_all_se.tsv that builds, at the same time:
+				dict:
+					key: term type (LLT, PT, ...), value: defaultdict(set) of drug -> side-effects.
+				dict:
+					key: flat id, value: stereo id (PubChemID)
 			
-			if my_preferred_term == termtype:
-				# side-effect
-				se = row[5].lower().strip()
-				
-				drugs_se[str(drug_id)].add(se)
+			The result is kept in the instance, later calls do not read the file again.
+		'''
+		if self.__all_se is not None:
+			return self.__all_se
 		
-		return drugs_se
+		self.__all_se = _ingest_meddra_all_se_file(self.__data_file('meddra_all_se.tsv'), self.vocabulary)
 		
-	def parser_meddra_freq(self, my_preferred_term = 'PT'):
+		return self.__all_se
+		
+	def parser_meddra_freq(self, my_preferred_term = 'PT', n_jobs = 1):
 		'''
 		Description of the file in the README:
 		
@@ -100,42 +270,52 @@ class SIDERParser(object):
 		matches the upper bound. Due to the nature of the data, there can be more than one frequency for the same label,
 		e.g. from different clinical trials or for different levels of severeness.
 
+		Set n_jobs > 1 (None = all the cores) to parse byte ranges of the file in worker processes; the
+		partial results are merged in file order, so the output is the same as the serial one.
+		
 		'''
+		filename = self.__data_file('meddra_freq.tsv')
 		
-		# get all the side-effects
-		selist = self.easyparser.parse_tsv(self.data_directory + 'meddra_freq.tsv')
+		if n_jobs is None:
+			n_jobs = cpu_count()
 		
-		# get the stitch CID (PubChem ID)
-		drugs_se = defaultdict()
+		# a few chunks per worker, to balance the load.
+		chunks = self.easyparser.tsv_chunks(filename, n_jobs * 4) if n_jobs > 1 else [(0, None)]
 		
-		for row in selist:
-		    # the stereo ID is equivalent to PubChem ID
-			drug_id = int(row[1][3::])
-			
-			# placebo, otherwise ''
-			placebo = False
-			if 'placebo' in row:
-				placebo = True
-			
-			# frequency of the side-effect 
-			frequency = row[4]
-
-			# term type: LLT or PT
-			termtype = row[7]
-
-			# side-effect
-			se = row[9].lower().strip()
+		if len(chunks) == 1:
+			# get all the side-effects. Rows of other term types are dropped on the raw line, before splitting it.
+			selist = self.easyparser.iter_tsv(filename, '\t' + my_preferred_term + '\t')
 			
-			if my_preferred_term == termtype:
+			return _parse_meddra_freq_rows(selist, my_preferred_term, self.vocabulary)
+		
+		pool = Pool(min(n_jobs, len(chunks)))
+		try:
+			partials = pool.map(_parse_meddra_freq_chunk, [(filename, my_preferred_term, chunk) for chunk in chunks])
+		finally:
+			pool.close()
+			pool.join()
+		
+		return self.__merge_meddra_freq(partials)
+		
+	def __merge_meddra_freq(self, partials):
+		'''
+			Merge the outputs of _parse_meddra_freq_chunk, given in file order.
+		'''
+		drugs_se = partials[0]
+		
+		for partial in partials[1::]:
+			for drug_id, side_effects in partial.iteritems():
 				if drug_id not in drugs_se:
-					drugs_se[drug_id] = dict()
-				
-				if se not in drugs_se[drug_id]:
-					drugs_se[drug_id][se] = defaultdict(list)
-					
-				drugs_se[drug_id][se]['placebo'].append(placebo)
-				drugs_se[drug_id][se]['frequency'].append(frequency)
+					drugs_se[drug_id] = side_effects
+					continue
 				
+				for se, data in side_effects.iteritems():
+					if se not in drugs_se[drug_id]:
+						drugs_se[drug_id][se] = data
+					else:
+						drugs_se[drug_id][se]['placebo'].extend(data['placebo'])
+						drugs_se[drug_id][se]['frequency'].extend(data['frequency'])
+		
 		return drugs_se
 		
 	def __flattoStereoID(self):
@@ -143,20 +323,7 @@ class SIDERParser(object):
 			dict:
 				key: flat id, value: stereo id (PubChemID)
 		'''
-		# get all the side-effects
-		selist = self.easyparser.parse_tsv(self.data_directory + 'meddra_all_se.tsv')
-		
-		# get the stitch CID (PubChem ID)
-		drugID = dict()
-		
-		for row in selist:
-		    # the stereo ID is equivalent to PubChem ID
-			stereo_id = int(row[1][3::])
-			
-			
-			flat_id = int(row[0][4::])
-			
-			drugID[flat_id] = stereo_id
+		drugs_se_by_term, drugID = self.__ingest_meddra_all_se()
 		
 		return drugID
 		
@@ -173,37 +340,203 @@ class SIDERParser(object):
 			All side effects found on the labels are given as LLT. Additionally, the PT is shown. There is at least one
 			PT for every LLT, but sometimes the PT is the same as the LLT.
 		'''
-		# get all the side-effects
-		indicationlist = self.easyparser.parse_tsv(self.data_directory + 'meddra_all_indications.tsv')
-		
-		# get the stitch CID 
-		drugs_indication = defaultdict(set)
+		# text mention indications of each flat ID
+		flat_indications = _parse_all_indications_file(self.__data_file('meddra_all_indications.tsv'), my_preferred_term, self.vocabulary)
 		
 		# get flat to stereo ID
 		IDConv = self.__flattoStereoID()
 		
-		for row in indicationlist:
-		    # flat drug ID 
-			flat_id = int(row[0][4::])
-			
+		return self.__indications_to_stereo(flat_indications, IDConv)
+		
+	def __indications_to_stereo(self, flat_indications, IDConv):
+		'''
+			Key the output of _parse_all_indications_file(...) by stereo ID (as a string), dropping
+			the flat IDs that are not in meddra_all_se.tsv.
+		'''
+		# get the stitch CID 
+		drugs_indication = defaultdict(set)
+		
+		for flat_id, indications in flat_indications.iteritems():
 			# stereo ID
 			if flat_id in IDConv:
 				stereo_id = IDConv[flat_id]
 				
-				#indication
-				myindication = row[6].lower().strip()
-				
-				# term type: LLT or PT
-				termtype = row[4]
-				
-				# only if it was text mention
-				if my_preferred_term == termtype:
-					if 'text_mention' in row[2].strip():
-						drugs_indication[str(stereo_id)].add(myindication)
+				drugs_indication[str(stereo_id)].update(indications)
 				
 		return drugs_indication
 	
-	def se_freq_breakdown(self, drugs_se):
+	def load_sider(self, my_preferred_term = 'PT', n_jobs = None):
+		'''
+			Load meddra_all_se.tsv, meddra_freq.tsv and meddra_all_indications.tsv concurrently. Each file is
+			read and parsed by worker processes (meddra_freq.tsv in byte ranges), so the wall-clock time is
+			close to the one of the slowest file instead of the sum of the three.
+			
+			returns the outputs of:
+				parser_meddra_all_se(...), parser_meddra_freq(...), parser_all_indications(...)
+		'''
+		if n_jobs is None:
+			n_jobs = cpu_count()
+		
+		freq_file = self.__data_file('meddra_freq.tsv')
+		
+		# two workers go to the other files, the rest share meddra_freq.tsv.
+		chunks = self.easyparser.tsv_chunks(freq_file, max(n_jobs - 2, 1) * 4)
+		
+		pool = Pool(max(n_jobs, 3))
+		try:
+			all_se_job = None
+			if self.__all_se is None:
+				all_se_job = pool.apply_async(_ingest_meddra_all_se_file, (self.__data_file('meddra_all_se.tsv'),))
+			
+			indications_job = pool.apply_async(_parse_all_indications_file, 
+				(self.__data_file('meddra_all_indications.tsv'), my_preferred_term))
+			
+			freq_job = pool.map_async(_parse_meddra_freq_chunk, [(freq_file, my_preferred_term, chunk) for chunk in chunks])
+			
+			if all_se_job is not None:
+				self.__all_se = all_se_job.get()
+			
+			flat_indications = indications_job.get()
+			partials = freq_job.get()
+		finally:
+			pool.close()
+			pool.join()
+		
+		sider_all_se = self.parser_meddra_all_se(my_preferred_term)
+		sider_freq = self.__merge_meddra_freq(partials)
+		sider_ind = self.__indications_to_stereo(flat_indications, self.__flattoStereoID())
+		
+		return sider_all_se, sider_freq, sider_ind
+	
+	def cached_stage(self, stage, compute, params = None, input_files = ('meddra_all_se.tsv', 'meddra_freq.tsv')):
+		'''
+			Output of compute(), from self.stage_cache if the stage already ran with the same SIDER files,
+			parameters and code (see StageCache.StageCache).
+				stage: name of the stage.
+				params: dict of the parameters of the stage.
+				input_files: SIDER files the stage depends on.
+		'''
+		if self.stage_cache is None:
+			self.stage_cache = stagecache.StageCache(self.result_directory + 'cache/')
+		
+		key = self.stage_cache.key(stage, [self.__data_file(f) for f in input_files], params)
+		
+		return self.stage_cache.get_or_compute(key, compute)
+	
+	def cached_frequency_outputs(self, my_preferred_term = 'PT'):
+		'''
+			The important variables of the data collection: the chain
+				parser_meddra_freq -> se_freq_breakdown -> preprocessingToFrequencyLabels -> UnifySets ->
+				removepairsInconsistencyFrequency -> finalDrugSElist
+			and the post-marketing and no frequency side-effects, with every stage cached on disk (cached_stage).
+			A warm run only loads the cached outputs it needs.
+			
+			returns:
+				sider_with_freq, unique_se_with_freq, sider_pmktg, sider_no_freq
+		'''
+		params = {'term': my_preferred_term}
+		outputs = dict()
+		
+		def stage(name, compute, input_files = ('meddra_all_se.tsv', 'meddra_freq.tsv')):
+			# each stage is loaded or computed at most once per call.
+			if name not in outputs:
+				outputs[name] = self.cached_stage(name, compute, params, input_files)
+			return outputs[name]
+		
+		def all_se():
+			return stage('parser_meddra_all_se', lambda: self.parser_meddra_all_se(my_preferred_term), ['meddra_all_se.tsv'])
+		
+		def fingerprint():
+			def compute():
+				drug_se_pair = self.se_freq_breakdown(self.parser_meddra_freq(my_preferred_term))
+				return self.preprocessingToFrequencyLabels(drug_se_pair, batched = True)
+			
+			return stage('preprocessingToFrequencyLabels', compute)
+		
+		def with_freq():
+			def compute():
+				DrugSEFilter, AllFrequencies = self.removepairsInconsistencyFrequency(self.UnifySets(fingerprint()[0]), batched = True)
+				return self.finalDrugSElist(DrugSEFilter)
+			
+			return stage('finalDrugSElist', compute)
+		
+		def pmktg():
+			return stage('UnifySetsPostmarketing', lambda: self.UnifySetsPostmarketing(fingerprint()[0], with_freq()[1]))
+		
+		def no_freq():
+			return stage('SideEffectswithNoFrequency', 
+				lambda: self.SideEffectswithNoFrequency(all_se(), with_freq()[0], pmktg(), with_freq()[1]))
+		
+		sider_with_freq, unique_se_with_freq = with_freq()
+		
+		return sider_with_freq, unique_se_with_freq, pmktg(), no_freq()
+	
+	def pipeline(self, my_preferred_term = 'PT', n_jobs = None):
+		'''
+			The stages of the data collection notebook as a Pipeline.Pipeline, named as the notebook variables:
+				sider_all_se, sider_1 (parser_meddra_freq), sider_2, sider_3 (VennCounterFreqType), sider_4, sider_placebo,
+				sider_5, sider_6, counter_1, sider_with_freq, unique_se_with_freq, sider_pmktg, sider_no_freq, sider_ind.
+			Only the stages the requested outputs depend on are run, e.g.
+				mysider.pipeline().run(['sider_with_freq', 'sider_ind'])
+			runs the indications and the frequency chain in parallel and never computes the Venn counts.
+			
+			The stages run in threads, so the files are parsed in worker processes (as in load_sider(...)): the
+			indications and meddra_all_se.tsv each in one, meddra_freq.tsv in byte ranges (n_jobs, None = all
+			the cores, 1 = no worker processes). The indications only wait for meddra_all_se.tsv to map their
+			flat IDs to stereo IDs. The preprocessing and the averages use the batched variants.
+		'''
+		term = my_preferred_term
+		
+		if n_jobs is None:
+			n_jobs = cpu_count()
+		
+		def all_se():
+			if self.__all_se is None:
+				self.__all_se = self.__call_in_worker(n_jobs, _ingest_meddra_all_se_file, self.__data_file('meddra_all_se.tsv'))
+			return self.parser_meddra_all_se(term)
+		
+		p = pipeline.Pipeline()
+		p.add('sider_all_se', all_se)
+		p.add('sider_1', lambda: self.parser_meddra_freq(term, n_jobs))
+		p.add('sider_2', self.se_freq_breakdown, ['sider_1'])
+		p.add('sider_3', self.VennCounterFreqType, ['sider_2'])
+		p.add('preprocessing', lambda sider_2: self.preprocessingToFrequencyLabels(sider_2, batched = True), ['sider_2'])
+		p.add('sider_4', lambda preprocessing: preprocessing[0], ['preprocessing'])
+		p.add('sider_placebo', lambda preprocessing: preprocessing[1], ['preprocessing'])
+		p.add('sider_5', self.UnifySets, ['sider_4'])
+		p.add('aggregation', lambda sider_5: self.removepairsInconsistencyFrequency(sider_5, batched = True), ['sider_5'])
+		p.add('sider_6', lambda aggregation: aggregation[0], ['aggregation'])
+		p.add('counter_1', lambda aggregation: aggregation[1], ['aggregation'])
+		p.add('final', self.finalDrugSElist, ['sider_6'])
+		p.add('sider_with_freq', lambda final: final[0], ['final'])
+		p.add('unique_se_with_freq', lambda final: final[1], ['final'])
+		p.add('sider_pmktg', self.UnifySetsPostmarketing, ['sider_4', 'unique_se_with_freq'])
+		p.add('sider_no_freq', self.SideEffectswithNoFrequency, 
+			['sider_all_se', 'sider_with_freq', 'sider_pmktg', 'unique_se_with_freq'])
+		# the indications file does not depend on meddra_all_se.tsv, only the flat -> stereo IDs do.
+		p.add('flat_indications', lambda: self.__call_in_worker(n_jobs, _parse_all_indications_file,
+			self.__data_file('meddra_all_indications.tsv'), term))
+		p.add('sider_ind', lambda flat_indications, sider_all_se: self.__indications_to_stereo(flat_indications,
+			self.__flattoStereoID()), ['flat_indications', 'sider_all_se'])
+		
+		return p
+	
+	def __call_in_worker(self, n_jobs, function, *args):
+		'''
+			function(*args) in a worker process, so that it does not hold the GIL of the pipeline threads
+			(here if n_jobs == 1). function must be module level.
+		'''
+		if n_jobs == 1:
+			return function(*args)
+		
+		pool = Pool(1)
+		try:
+			return pool.apply(function, args)
+		finally:
+			pool.close()
+			pool.join()
+	
+	def se_freq_breakdown(self, drugs_se, columnar = False):
 		'''
 		   REQUIREMENT: input should be output of parser_meddra_freq(...)
 		   
@@ -213,8 +546,27 @@ class SIDERParser(object):
 		   3- placebo_range_freq: frequency for the placebo (if any). There are always percentages,i.e. 3%
 		   4- range_freq: frequency range. Sometimes it is provide frequency range 1-5%, 1 to 5% 
 		   5- label_freq: label (common, very common, rare, ...).
+		   
+		   columnar: return a PairStore.PairStore instead, a columnar store of the pairs and their values without
+		   "drug|se" string keys (store.to_pair_dict() gives the dictionary).
 		'''
 
+		entries = self.__frequency_entries
+		
+		if columnar:
+			store = pairstore.PairStore(self.vocabulary)
+			
+			for drug_id, side_effects in drugs_se.iteritems():
+				for se, data in side_effects.iteritems():
+					values = list()
+					for placebo, fq in izip(data['placebo'], data['frequency']):
+						entry = entries[placebo].get(fq) or self.__frequency_entry(fq, placebo)
+						values.extend(entry[2])
+					
+					store.add_pair(drug_id, se, values)
+			
+			return store
+		
 		drug_se_pair = dict()
 		   
 		for drug_id, side_effects in drugs_se.iteritems():    
@@ -225,58 +577,56 @@ class SIDERParser(object):
 				
 				pairID = drugID + se		
 				
-				drug_se_pair[pairID] =  defaultdict(list)          
-			 
-				isPlacebo = data['placebo']
+				fiels = drug_se_pair[pairID] = defaultdict(list)
 				
-				# For this particular drug and side-effect pair:
-				for Idx, fq in enumerate(data['frequency']):      
-				    
-					# CASE: Frequency is not placebo
-					if isPlacebo[Idx] == False: 
-					
-						# subCASE: Frequency is an exact number
-						try:
-							exact_freq = float(fq.strip('%'))
-							drug_se_pair[pairID]['exact_freq'].append(exact_freq)
-
-						except:
-							
-							
-							# Fix for cases in which we have FREQUENCIES like 1-9%. We append the average.                      
-							fq = fq.replace('%','').replace(' ','').replace('-',';').replace('to',';').replace('<','') 
-
-							# subCASE: is a range of frequency
-							if ';' in fq: # it is a range 							   
-								n1 = float(fq.split(';')[0])
-								n2 = float(fq.split(';')[1])
-								
-								# We append both data in the range.
-								drug_se_pair[pairID]['range_freq'].append(n1)
-								drug_se_pair[pairID]['range_freq'].append(n2)
-
-							else: # subCASE: is a label frequency
-								fq = self.__NormalizeFrequencyLabels(fq) # normalization.
-								drug_se_pair[pairID]['label_freq'].append(fq)
-
-					else: # placebo frequencies processing
-						
-						# subCASE: Frequency is an exact number
-						try:
-							exact_freq = float(fq.strip('%'))
-							drug_se_pair[pairID]['placebo_exact_freq'].append(exact_freq)
-						except:
-							# Fix for cases in which we have FREQUENCIES like 1-9%. We append the average.
-							fq = fq.replace('%','').replace(' ','').replace('-',';').replace('to',';').replace('<','')                   
-
-							if ';' in fq: # placebo is a range.
-								n1 = float(fq.split(';')[0])
-								n2 = float(fq.split(';')[1])
-								drug_se_pair[pairID]['placebo_range_freq'].append(n1)
-								drug_se_pair[pairID]['placebo_range_freq'].append(n2)
+				# For this particular drug and side-effect pair: one dict lookup per frequency.
+				for placebo, fq in izip(data['placebo'], data['frequency']):
+					entry = entries[placebo].get(fq) or self.__frequency_entry(fq, placebo)
+					if entry[1]:
+						fiels[entry[0]].extend(entry[1])
 
 		return drug_se_pair  
 		
+	def __frequency_entry(self, fq, placebo):
+		'''
+			What se_freq_breakdown(...) adds for a frequency description, computed once per description:
+				key of the drug_se_pair dict (e.g. 'range_freq'), values, the same values as (value type, value)
+				with the value types of PairStore.py.
+		'''
+		# parsed once per distinct description (exact, range or label).
+		description = self.frequency_parser.parse(fq)
+		
+		# CASE: Frequency is not placebo
+		if not placebo: 
+		
+			# subCASE: Frequency is an exact number
+			if description.kind == frequencyparser.EXACT:
+				value_type, values = pairstore.EXACT_FREQ, description.values
+			
+			# subCASE: is a range of frequency. We append both data in the range.
+			elif description.kind == frequencyparser.RANGE:
+				value_type, values = pairstore.RANGE_FREQ, description.values
+			
+			else: # subCASE: is a label frequency (already normalized).
+				value_type, values = pairstore.LABEL_FREQ, (description.label,)
+
+		else: # placebo frequencies processing
+			
+			# subCASE: Frequency is an exact number
+			if description.kind == frequencyparser.EXACT:
+				value_type, values = pairstore.PLACEBO_EXACT_FREQ, description.values
+			
+			elif description.kind == frequencyparser.RANGE: # placebo is a range.
+				value_type, values = pairstore.PLACEBO_RANGE_FREQ, description.values
+			
+			else: # placebo labels are dropped.
+				value_type, values = None, ()
+		
+		entry = (pairstore.VALUE_TYPES[value_type] if values else None, values, tuple((value_type, v) for v in values))
+		self.__frequency_entries[placebo][fq] = entry
+		
+		return entry
+		
 	def VennCounterFreqType(self, drug_se_pair):
 		'''
 		 REQUIREMENT: input should be output of drug_se_pair(...)
@@ -292,65 +642,55 @@ class SIDERParser(object):
 		# Counter to be return
 		set_counter = dict()
 
-		# useful definitions
-		typeFrequencies = ['exact_freq', 'range_freq', 'label_freq', 'placebo_exact_freq', 'placebo_range_freq']		
-		A = ['exact_freq', 'range_freq']
-		B = ['label_freq']
-		C = ['placebo_exact_freq', 'placebo_range_freq']
-		sets = ['A', 'B', 'C']
-		operations = ['A-all','B-all', 'C-all', 'A & B', 'A & C', 'B & C', 'A & B & C']
+		# number of pairs for each combination of the bits A, B and C.
+		counts = np.bincount(self.__masks(drug_se_pair), minlength=8).tolist()
 		
-		# possible set operations
-		for v in operations:
-			set_counter[v] = 0
-
-		for eachpair, fiels in drug_se_pair.iteritems():
-		   			
-			if 'exact_freq' in fiels or 'range_freq' in fiels: # set A
-				ban = 0 
-			   
-				if 'label_freq' in fiels: # set B
-					set_counter['A & B'] += 1             
-					
-					ban = 1     
-					if 'placebo_exact_freq' in fiels or 'placebo_range_freq' in fiels: # set C
-						set_counter['A & B & C'] += 1 
-
-
-				if 'placebo_exact_freq' in fiels or 'placebo_range_freq' in fiels: # set C
-					set_counter['A & C'] += 1 
-					ban = 1
-
-
-				if ban == 0:
-					set_counter['A-all'] += 1 
-
-			if 'label_freq' in fiels: # set B.
-			   
-				ban = 0  
-				if 'placebo_exact_freq' in fiels or 'placebo_range_freq' in fiels: # set C
-					ban = 1
-					set_counter['B & C'] += 1 					
-
-				if 'exact_freq' in fiels or 'range_freq' in fiels: # set A
-					ban = 1
-
-				if ban == 0:
-					set_counter['B-all'] += 1
-
-			if 'placebo_exact_freq' in fiels or 'placebo_range_freq' in fiels: # set C
-				ban = 0
-			   
-				if 'exact_freq' in fiels or 'range_freq' in fiels or 'label_freq' in fiels: # set A or B
-					ban = 1
-				#else:
-					#print drugSEpair
-
-				if ban == 0:
-					set_counter['C-all'] += 1 
+		set_counter['A-all'] = counts[SET_A]
+		set_counter['B-all'] = counts[SET_B]
+		set_counter['C-all'] = counts[SET_C]
+		set_counter['A & B'] = counts[SET_A | SET_B] + counts[SET_A | SET_B | SET_C]
+		set_counter['A & C'] = counts[SET_A | SET_C] + counts[SET_A | SET_B | SET_C]
+		set_counter['B & C'] = counts[SET_B | SET_C] + counts[SET_A | SET_B | SET_C]
+		set_counter['A & B & C'] = counts[SET_A | SET_B | SET_C]
 
 		return set_counter
 	
+	def FrequencyTypeMasks(self, drug_se_pair):
+		'''
+			REQUIREMENT: input should be output of se_freq_breakdown(...)
+			The frequency types of each pair encoded as a bitmask:
+				SET_A: exact_freq or range_freq.
+				SET_B: label_freq.
+				SET_C: placebo_exact_freq or placebo_range_freq.
+				
+			A PairStore.PairStore (se_freq_breakdown(..., columnar = True)) is also accepted.
+				
+			returns:
+				list of pairs, numpy array of masks (uint8) in the same order.
+		'''
+		if isinstance(drug_se_pair, pairstore.PairStore):
+			return drug_se_pair.pair_keys(), drug_se_pair.masks()
+		
+		# the masks are computed in the iteration order of the dict, the same as keys().
+		return drug_se_pair.keys(), self.__masks(drug_se_pair)
+	
+	def __masks(self, drug_se_pair):
+		'''
+			Masks of FrequencyTypeMasks(...) only, without the list of pairs.
+		'''
+		if isinstance(drug_se_pair, pairstore.PairStore):
+			return drug_se_pair.masks()
+		
+		# one byte per pair, moved to numpy at the end.
+		masks = bytearray()
+		
+		for fiels in drug_se_pair.itervalues():
+			masks.append((SET_A if 'exact_freq' in fiels or 'range_freq' in fiels else 0) |
+						 (SET_B if 'label_freq' in fiels else 0) |
+						 (SET_C if 'placebo_exact_freq' in fiels or 'placebo_range_freq' in fiels else 0))
+		
+		return np.frombuffer(bytes(masks), dtype=np.uint8)
+	
 	def plotVennDiagramFreqType(self, set_counter, directory = ''):
 		'''	
 		 REQUIREMENT: input should be output of VennCounterFreqType(...)
@@ -403,7 +743,7 @@ class SIDERParser(object):
 
 
 		
-	def preprocessingToFrequencyLabels(self,drug_se_pair):
+	def preprocessingToFrequencyLabels(self,drug_se_pair, batched = False, pair_indices = False):
 		'''
 			This function pre-process and filter the drug_se_pair, according to different criterias:
 			
@@ -423,6 +763,14 @@ class SIDERParser(object):
 				5) A & B & C, we can obtain later. same criteria but intersect.
 				6) B & C, deleted the placebo frequency, keep the labels.
 				7) B-all, keep the labels.
+			
+			batched: compute the drug and placebo medians of all the pairs at once, with a grouped median
+				over flat arrays (MyUtilities.GroupedMedian), instead of one numpy call per pair. Same output.
+				A PairStore.PairStore (se_freq_breakdown(..., columnar = True)) is always processed this way.
+			pair_indices: with a PairStore, key the pairs by their index in the store instead of "drug|se". The
+				indexes go through UnifySets(...) and removepairsInconsistencyFrequency(...) as they are, and
+				IndexedDrugSElist(..., store) and UnifySetsPostmarketing(..., store = store) read the drug and
+				side-effect of each pair from the store columns.
 		'''
 		operations = ["A-[B U C]","B-[A U C]", "C-[A U B]", "A & B", "A & C", "B & C", "A & B & C"]
 		drug_se_fingerprint = dict()
@@ -430,12 +778,29 @@ class SIDERParser(object):
 		for v in operations:
 			drug_se_fingerprint[v] = dict()
 			
+		if isinstance(drug_se_pair, pairstore.PairStore):
+			self.__preprocessingBatched(drug_se_pair, drug_se_fingerprint, placeboGroup, pair_indices)
+			
+			return drug_se_fingerprint, placeboGroup
+			
+		if batched:
+			store = pairstore.PairStore(self.vocabulary).add_pair_dict(drug_se_pair)
+			self.__preprocessingBatched(store, drug_se_fingerprint, placeboGroup)
+			
+			return drug_se_fingerprint, placeboGroup
+			
+		# WHO scores of the medians and of the labels (see self.frequency_scale).
+		score = self.frequency_scale.score
+		label_scores = self.frequency_scale.label_scores
+		
 		for drugSEpair, fiels in drug_se_pair.iteritems():
 		
 			# We compute the median frequencies if we can.
 			A = False
 			B = False
 			C = False
+			MedDrug = None
+			MedPlacebo = None
 			
 			if 'exact_freq' in fiels or 'range_freq' in fiels: # set A
 				A = True            
@@ -466,70 +831,122 @@ class SIDERParser(object):
 			if 'label_freq' in fiels: # set B 
 				B = True
 				
-			# We can ask about the cases.
-			if A & B:            
-				if drugSEpair not in drug_se_fingerprint["A & B"]:
-					drug_se_fingerprint["A & B"][drugSEpair] = defaultdict(list)
-					
-				
-				drug_se_fingerprint["A & B"][drugSEpair]['LabelFreq'].append(self.__SideEffectFingerprint(self.__MappingFreqtoLabel(MedDrug)))    
+			ScoreDrug = None
+			ScorePlacebo = None
+			LabelScores = list()
+			
+			if A:
+				ScoreDrug = score(MedDrug)
+			if C:
+				ScorePlacebo = score(MedPlacebo)
+			if B:
+				LabelScores = [label_scores.get(v, -1) for v in fiels['label_freq']]
+			
+			self.__fingerprint_pair(drug_se_fingerprint, placeboGroup, drugSEpair, A, B, C, MedDrug, MedPlacebo,
+									ScoreDrug, ScorePlacebo, LabelScores)
+		
+		return drug_se_fingerprint, placeboGroup
+
+	def __preprocessingBatched(self, store, drug_se_fingerprint, placeboGroup, pair_indices = False):
+		'''
+			Batched version of preprocessingToFrequencyLabels(...) over a PairStore.PairStore: the drug and
+			placebo frequencies of all the pairs are taken as flat arrays with the number of values of each pair,
+			and all the medians are computed in one grouped operation. The medians and the labels are then
+			mapped to their WHO scores with the array API of self.frequency_scale. The sets of each pair come
+			from the store bitmasks (see FrequencyTypeMasks(...)).
+			pair_indices: key the pairs by their index in the store, otherwise by "drug|se".
+		'''
+		masks = store.masks()
+		
+		A = (masks & SET_A) > 0
+		B = (masks & SET_B) > 0
+		C = (masks & SET_C) > 0
+		
+		freq, freqLengths = store.grouped_values([pairstore.EXACT_FREQ, pairstore.RANGE_FREQ])
+		freqPlacebo, freqPlaceboLengths = store.grouped_values([pairstore.PLACEBO_EXACT_FREQ, pairstore.PLACEBO_RANGE_FREQ])
+		labels, labelLengths = store.grouped_values([pairstore.LABEL_FREQ])
+		
+		MedDrug = self.utilities.GroupedMedian(freq, freqLengths)
+		MedPlacebo = self.utilities.GroupedMedian(freqPlacebo, freqPlaceboLengths)
+		
+		# WHO scores of all the medians and of all the labels at once.
+		ScoreDrug = self.frequency_scale.scores(MedDrug).tolist()
+		ScorePlacebo = self.frequency_scale.scores(MedPlacebo).tolist()
+		LabelScores = self.frequency_scale.labels_to_scores(store.labels.labels)[labels.astype(np.int64)].tolist()
+		labelOffsets = np.concatenate(([0], np.cumsum(labelLengths))).tolist()
+		
+		# pairs without any frequency do not go to any set.
+		for idx in np.flatnonzero(masks).tolist():
+			self.__fingerprint_pair(drug_se_fingerprint, placeboGroup, idx if pair_indices else store.pair_key(idx),
+				bool(A[idx]), bool(B[idx]), bool(C[idx]),
+				MedDrug[idx], MedPlacebo[idx], ScoreDrug[idx], ScorePlacebo[idx],
+				LabelScores[labelOffsets[idx]:labelOffsets[idx + 1]])
+		
+	def __fingerprint_pair(self, drug_se_fingerprint, placeboGroup, drugSEpair, A, B, C, MedDrug, MedPlacebo,
+						   ScoreDrug, ScorePlacebo, LabelScores):
+		'''
+			Add the pair to the set operations of drug_se_fingerprint (and placeboGroup) it belongs to,
+			see preprocessingToFrequencyLabels(...).
+				ScoreDrug, ScorePlacebo: WHO scores of the median frequencies (if any).
+				LabelScores: WHO scores of the frequency labels of the pair.
+		'''
+		# We can ask about the cases.
+		if A & B:            
+			if drugSEpair not in drug_se_fingerprint["A & B"]:
+				drug_se_fingerprint["A & B"][drugSEpair] = defaultdict(list)
 				
-				for v in fiels['label_freq']:                   
-					drug_se_fingerprint["A & B"][drugSEpair]['LabelFreq'].append(self.__SideEffectFingerprint(v))
-						
-			if A & C: 
-				if (MedDrug > MedPlacebo):
-					if drugSEpair not in drug_se_fingerprint["A & C"]:
-						drug_se_fingerprint["A & C"][drugSEpair] = defaultdict(list)
-						
-					
-					drug_se_fingerprint["A & C"][drugSEpair]['LabelFreq'].append(self.__SideEffectFingerprint(self.__MappingFreqtoLabel(MedDrug))) 
-				else:
-					placeboGroup[drugSEpair].append(self.__SideEffectFingerprint(self.__MappingFreqtoLabel(MedDrug)))
-					placeboGroup[drugSEpair].append(self.__SideEffectFingerprint(self.__MappingFreqtoLabel(MedPlacebo)))
+			
+			drug_se_fingerprint["A & B"][drugSEpair]['LabelFreq'].append(ScoreDrug)    
+			
+			drug_se_fingerprint["A & B"][drugSEpair]['LabelFreq'].extend(LabelScores)
 					
-			if A & ~B & ~C:
-				if drugSEpair not in drug_se_fingerprint["A-[B U C]"]:
-					drug_se_fingerprint["A-[B U C]"][drugSEpair] = defaultdict(list)
+		if A & C: 
+			if (MedDrug > MedPlacebo):
+				if drugSEpair not in drug_se_fingerprint["A & C"]:
+					drug_se_fingerprint["A & C"][drugSEpair] = defaultdict(list)
 					
-				#drug_se_fingerprint["A-[B U C]"][drugSEpair]['MedianFreq'].append(MedDrug)
-				drug_se_fingerprint["A-[B U C]"][drugSEpair]['LabelFreq'].append(self.__SideEffectFingerprint(self.__MappingFreqtoLabel(MedDrug)))   
 				
-			if B & C:
-				if drugSEpair not in drug_se_fingerprint["B & C"]:
-					drug_se_fingerprint["B & C"][drugSEpair] = defaultdict(list)
-					
-				# we only grap the labels from B.
-				for v in fiels['label_freq']:                   
-					drug_se_fingerprint["B & C"][drugSEpair]['LabelFreq'].append(self.__SideEffectFingerprint(v))
+				drug_se_fingerprint["A & C"][drugSEpair]['LabelFreq'].append(ScoreDrug) 
+			else:
+				placeboGroup[drugSEpair].append(ScoreDrug)
+				placeboGroup[drugSEpair].append(ScorePlacebo)
+				
+		if A & ~B & ~C:
+			if drugSEpair not in drug_se_fingerprint["A-[B U C]"]:
+				drug_se_fingerprint["A-[B U C]"][drugSEpair] = defaultdict(list)
+				
+			#drug_se_fingerprint["A-[B U C]"][drugSEpair]['MedianFreq'].append(MedDrug)
+			drug_se_fingerprint["A-[B U C]"][drugSEpair]['LabelFreq'].append(ScoreDrug)   
+			
+		if B & C:
+			if drugSEpair not in drug_se_fingerprint["B & C"]:
+				drug_se_fingerprint["B & C"][drugSEpair] = defaultdict(list)
+				
+			# we only grap the labels from B.
+			drug_se_fingerprint["B & C"][drugSEpair]['LabelFreq'].extend(LabelScores)
 		   
-			if C & ~A & ~B: # we are not interested in this case, but save it to see it.
-				if drugSEpair not in drug_se_fingerprint["C-[A U B]"]:
-					drug_se_fingerprint["C-[A U B]"][drugSEpair] = defaultdict(list)
+		if C & ~A & ~B: # we are not interested in this case, but save it to see it.
+			if drugSEpair not in drug_se_fingerprint["C-[A U B]"]:
+				drug_se_fingerprint["C-[A U B]"][drugSEpair] = defaultdict(list)
+				
+			drug_se_fingerprint["C-[A U B]"][drugSEpair]['MedPlacebo'].append(MedPlacebo)
+		
+		if A & B & C:
+			if drugSEpair not in drug_se_fingerprint["A & B & C"]:
+				drug_se_fingerprint["A & B & C"][drugSEpair] = defaultdict(list)
+				
+			if (MedDrug > MedPlacebo):
 					
-				drug_se_fingerprint["C-[A U B]"][drugSEpair]['MedPlacebo'].append(MedPlacebo)
-			
-			if A & B & C:
-				if drugSEpair not in drug_se_fingerprint["A & B & C"]:
-					drug_se_fingerprint["A & B & C"][drugSEpair] = defaultdict(list)
+				#drug_se_fingerprint["A & B & C"][drugSEpair]['MedianFreq'].append(MedDrug) 
+				drug_se_fingerprint["A & B & C"][drugSEpair]['LabelFreq'].append(ScoreDrug)   
+				
+			drug_se_fingerprint["A & B & C"][drugSEpair]['LabelFreq'].extend(LabelScores)
 					
-				if (MedDrug > MedPlacebo):
-						
-					#drug_se_fingerprint["A & B & C"][drugSEpair]['MedianFreq'].append(MedDrug) 
-					drug_se_fingerprint["A & B & C"][drugSEpair]['LabelFreq'].append(self.__SideEffectFingerprint(self.__MappingFreqtoLabel(MedDrug)))   
+		if B & ~A & ~C:
+			if drugSEpair not in drug_se_fingerprint["B-[A U C]"]:
+				drug_se_fingerprint["B-[A U C]"][drugSEpair] = defaultdict(list)
 					
-				for v in fiels['label_freq']:                   
-					drug_se_fingerprint["A & B & C"][drugSEpair]['LabelFreq'].append(self.__SideEffectFingerprint(v))
-						
-			if B & ~A & ~C:
-				if drugSEpair not in drug_se_fingerprint["B-[A U C]"]:
-					drug_se_fingerprint["B-[A U C]"][drugSEpair] = defaultdict(list)
-						
-				for v in fiels['label_freq']:                   
-					drug_se_fingerprint["B-[A U C]"][drugSEpair]['LabelFreq'].append(self.__SideEffectFingerprint(v))
-
-		
-		return drug_se_fingerprint, placeboGroup
+			drug_se_fingerprint["B-[A U C]"][drugSEpair]['LabelFreq'].extend(LabelScores)
 
 	def UnifySets(self,drug_se_fingerprint):
 		'''
@@ -549,51 +966,141 @@ class SIDERParser(object):
 							filter_pairs[pair].add(freq)
 		return filter_pairs
 	
-	def UnifySetsPostmarketing(self, drug_se_fingerprint, unique_se_with_freq):
+	def UnifySetsPostmarketing(self, drug_se_fingerprint, unique_se_with_freq, as_bitmatrix = False, store = None):
 		'''
 			We only return post-marketing side-effects that have no known frequency
+			
+			The pairs are gathered in a BitMatrix.BitMatrix (drugs x side-effects of self.vocabulary) and restricted
+			to unique_se_with_freq with a column mask.
+			as_bitmatrix: return that matrix instead of the dict (see SideEffectswithNoFrequency(...)).
+			store: the PairStore.PairStore of preprocessingToFrequencyLabels(..., pair_indices = True). The pairs are
+				then store indexes, and unique_se_with_freq the side-effect indexes given by IndexedDrugSElist(...).
 		'''
-		filter_pairs = defaultdict(set)
 		operations = ["A-[B U C]","B-[A U C]", "A & B", "A & C", "B & C"]
-
+		
+		rows = list()
+		cols = list()
+		
 		# For each operation
 		for op in operations:
 			# For each drug-se pair
-			for pair in drug_se_fingerprint[op]:
-				# Each pair suppose to be unique
-				if pair not in filter_pairs:
-					listfreq = drug_se_fingerprint[op][pair]['LabelFreq']
-					if -1 in listfreq and len(listfreq) == 1: # only postmarketing						
-						drugID, se = pair.split('|')
-						if se in unique_se_with_freq:
-							filter_pairs[drugID].add(se)
-							
-		return filter_pairs
+			for pair, fiels in drug_se_fingerprint[op].iteritems():
+				if fiels['LabelFreq'] == [-1]: # only postmarketing
+					if store is not None:
+						rows.append(pair)
+						continue
+					
+					drugID, se = pair.split('|')
+					rows.append(self.vocabulary.drugs.add(int(drugID)))
+					cols.append(self.vocabulary.terms.add(se))
+		
+		if store is None:
+			term_mask = self.__term_mask(unique_se_with_freq)
+		else:
+			pair_drug, pair_se = store.columns()[:2]
+			rows, cols = pair_drug[rows], pair_se[rows]
+			
+			term_mask = np.zeros(len(self.vocabulary.terms), dtype=bool)
+			term_mask[list(unique_se_with_freq)] = True
+		
+		postmarketing = bitmatrix.BitMatrix.from_indices(rows, cols, len(self.vocabulary.drugs), len(self.vocabulary.terms))
+		postmarketing = postmarketing.mask_columns(term_mask)
+		
+		if as_bitmatrix:
+			return postmarketing
+		
+		return self.__bitmatrix_to_profile(postmarketing, set)
 	
-	def SideEffectswithNoFrequency(self, all_se, se_with_freq, pmktg_se, unique_se_with_freq):
+	def SideEffectswithNoFrequency(self, all_se, se_with_freq, pmktg_se, unique_se_with_freq, as_bitmatrix = False):
 		'''
 			return side-effects with no frequency information or postmarketing
+			
+			Computed on BitMatrix.BitMatrix masks (drugs x side-effects of self.vocabulary):
+				all - with frequency - postmarketing, for the drugs with frequency and the side-effects in unique_se_with_freq.
+			pmktg_se can be the dict or the matrix given by UnifySetsPostmarketing(...).
+			as_bitmatrix: return the matrix instead of the dict.
+		'''
+		all_se = self.__profile_to_bitmatrix(all_se)
+		se_with_freq_matrix = self.__profile_to_bitmatrix(se_with_freq)
+		pmktg_se = self.__profile_to_bitmatrix(pmktg_se)
+		
+		# the vocabulary may have grown while the matrices were built.
+		shape = (len(self.vocabulary.drugs), len(self.vocabulary.terms))
+		all_se, se_with_freq_matrix, pmktg_se = [m.resize(*shape) for m in (all_se, se_with_freq_matrix, pmktg_se)]
+		
+		drug_mask = np.zeros(shape[0], dtype=bool)
+		drug_mask[[self.vocabulary.drugs[int(drug)] for drug in se_with_freq]] = True
+		
+		drugs_no_freq = all_se.andnot(se_with_freq_matrix | pmktg_se)
+		drugs_no_freq = drugs_no_freq.mask_rows(drug_mask).mask_columns(self.__term_mask(unique_se_with_freq))
+		
+		if as_bitmatrix:
+			return drugs_no_freq
+		
+		return self.__bitmatrix_to_profile(drugs_no_freq, list)
+	
+	def __profile_to_bitmatrix(self, drug_dict):
+		'''
+			BitMatrix.BitMatrix of a dict {drug: set(side-effects)} (or {drug: {side-effect: ...}}), over the drugs and
+			side-effects of self.vocabulary (new ones are added). A BitMatrix is given back as it is.
 		'''
+		if isinstance(drug_dict, bitmatrix.BitMatrix):
+			return drug_dict
 		
-		drugs_no_freq = defaultdict(list)
+		rows = list()
+		cols = list()
 		
-		for drug, listse in all_se.iteritems():
+		for drug, listse in drug_dict.iteritems():
+			drug_idx = self.vocabulary.drugs.add(int(drug))
 			for se in listse:
-				# the drug should be in my list of interest
-				if drug in se_with_freq and se in unique_se_with_freq:
-					# only if the se does not have frequency nor postmarketing
-					if se not in se_with_freq[drug]:
-						if drug not in pmktg_se or se not in pmktg_se[drug]:
-							drugs_no_freq[drug].append(se)
-				
-		return drugs_no_freq
+				rows.append(drug_idx)
+				cols.append(self.vocabulary.terms.add(se))
+		
+		return bitmatrix.BitMatrix.from_indices(rows, cols, len(self.vocabulary.drugs), len(self.vocabulary.terms))
+	
+	def __bitmatrix_to_profile(self, matrix, container):
+		'''
+			Inverse of __profile_to_bitmatrix: defaultdict(container) {drug (str): side-effects}.
+		'''
+		profile = defaultdict(container)
+		drugs = self.vocabulary.drugs.labels
+		terms = self.vocabulary.terms.labels
+		
+		add = set.add if container is set else list.append
 		
-	def removepairsInconsistencyFrequency(self,filter_pairs):
+		for drug_idx, se_idx in izip(*matrix.nonzero()):
+			add(profile[str(drugs[drug_idx])], terms[se_idx])
+		
+		return profile
+	
+	def __term_mask(self, terms):
+		'''
+			Boolean vector over the terms of self.vocabulary, True for the given terms.
+		'''
+		mask = np.zeros(len(self.vocabulary.terms), dtype=bool)
+		mask[[self.vocabulary.terms[term] for term in terms if term in self.vocabulary.terms]] = True
+		
+		return mask
+		
+	def removepairsInconsistencyFrequency(self,filter_pairs, batched = False):
 		'''
 			In this method we count how many pairs have different labels.			
 			UPDATE: we will average those that are different.
+			
+			batched: compute the averages of all the pairs in one grouped operation, and the Counter of the
+				averages from a bincount, instead of two numpy calls per pair. Same output.
 		'''
 		
+		if batched:
+			pairs = list(filter_pairs.keys())
+			means, AllFrequencies = self.__batched_pair_means(filter_pairs, pairs)
+			
+			DrugSEFilter = defaultdict(list)
+			for pair, mean in izip(pairs, means):
+				DrugSEFilter[pair].append(mean)
+			
+			return DrugSEFilter, AllFrequencies
+		
 		count = dict()
 		
 		DrugSEFilter = defaultdict(list)
@@ -638,7 +1145,7 @@ class SIDERParser(object):
 			
 			data = drugID.split('|')
 			pubchemID = data[0]
-			side_effect = data[1].lower().strip()
+			side_effect = self.vocabulary.term(data[1])
 			unique_side_effects.add(side_effect)			
 			
 			if pubchemID not in drug_se_profile:
@@ -650,63 +1157,77 @@ class SIDERParser(object):
 	
 		return drug_se_profile, unique_side_effects
 	
+	def IndexedDrugSElist(self, filter_pairs, store = None):
+		'''
+			REQUIREMENT: input should be output of UnifySets(...)
+			Batched removepairsInconsistencyFrequency(...) followed by finalDrugSElist(...): the averages of all
+			the pairs are computed at once, and the profile is emitted straight in integer space (self.vocabulary).
+			DICT: 
+				key: index of the drug.
+				value: DICT:
+					key: index of the side-effect
+					value: frequency of the side-effect for the drug.
+			
+			returns:
+				drug_se_profile, list of side-effect indexes, Counter of the frequencies.
+			
+			self.vocabulary.decode_profile(drug_se_profile) gives the output of finalDrugSElist(...).
+			
+			store: the PairStore.PairStore of preprocessingToFrequencyLabels(..., pair_indices = True), whose store
+				indexes key filter_pairs. The drug and side-effect indexes are then read from its columns.
+		'''
+		# sorted, so the new drugs and side-effects get the same indexes in every run.
+		pairs = sorted(filter_pairs)
+		means, AllFrequencies = self.__batched_pair_means(filter_pairs, pairs)
+		
+		if store is None:
+			indexes = [self.__pair_indexes(pair) for pair in pairs]
+		else:
+			pair_drug, pair_se = store.columns()[:2]
+			indexes = izip(pair_drug[pairs].tolist(), pair_se[pairs].tolist())
+		
+		drug_se_profile = dict()
+		unique_side_effects = set()
+		
+		for (drug_idx, se_idx), mean in izip(indexes, means):
+			unique_side_effects.add(se_idx)
+			
+			if drug_idx not in drug_se_profile:
+				drug_se_profile[drug_idx] = dict()
+			
+			drug_se_profile[drug_idx][se_idx] = [mean]
+		
+		return drug_se_profile, sorted(unique_side_effects), AllFrequencies
+	
+	def __pair_indexes(self, pair):
+		'''
+			Drug and side-effect indexes (in self.vocabulary) of a "drug|se" key, added if they are new.
+		'''
+		data = pair.split('|')
+		
+		return self.vocabulary.drugs.add(int(data[0])), self.vocabulary.terms.add(self.vocabulary.term(data[1]))
+	
+	def __batched_pair_means(self, filter_pairs, pairs):
+		'''
+			Average of the frequencies of each pair (in the order of pairs), with one grouped operation, and the
+			Counter of the averages from a bincount over their distinct values.
+		'''
+		lengths = [len(filter_pairs[pair]) for pair in pairs]
+		values = list(chain.from_iterable(filter_pairs[pair] for pair in pairs))
+		
+		means = self.utilities.GroupedMean(values, lengths)
+		
+		unique_means, inverse = np.unique(means, return_inverse=True)
+		AllFrequencies = Counter(dict(izip(unique_means.tolist(), np.bincount(inverse).tolist())))
+		
+		return means.tolist(), AllFrequencies
+	
 	def __median(self, lst):
 		'''
 			This function allows to compute the median for a list of numbers.
 		'''
 		return numpy.median(numpy.array(lst))
 		
-	def __SideEffectFingerprint(self,label):
-		'''
-			This function receives as input the frequency of the side-effect and returns the corresponding value for it, 
-			according to the WHO (Collaborating Centre for Drug Statistics Methodology).
-						very common >= 10% 
-				 1% <=  common or frequent < 10%  
-			   0.1% <=  uncommon or infrequent < 1%
-			  0.01% <=  rare     < 0.1% 
-						very rare < 0.01%
-					   
-		'''
-		value = -1 # postmarketing
-
-		if label == 'veryfrequent':
-			value = 5
-		elif label == 'frequent':
-			value = 4
-		elif label == 'infrequent':
-			value = 3
-		elif label == 'rare':
-			value = 2
-		elif label == 'veryrare':
-			value = 1
-			   
-		return value
-		
-	def __MappingFreqtoLabel(self,fq):
-		'''
-			This function receives as input the frequency of the side-effect and returns the corresponding label for it, 
-			according to the WHO (Collaborating Centre for Drug Statistics Methodology).
-						very common >= 10% 
-				 1% <=  common or frequent < 10%  
-			   0.1% <=  uncommon or infrequent < 1%
-			  0.01% <=  rare     < 0.1% 
-						very rare < 0.01%
-					   
-		'''
-		label = 'error'
-		if fq >= 10:
-			label = 'veryfrequent'
-		elif fq >= 1:
-			label = 'frequent'
-		elif fq >= 0.1:
-			label = 'infrequent'
-		elif fq >= 0.01:
-			label = 'rare'
-		elif fq < 0.01:
-			label = 'veryrare'
-			   
-		return label
-
 	def __NormalizeFrequencyLabels(self, fqLabel):
 
 		if fqLabel == 'common':       
@@ -0,0 +1,184 @@
+import math
+import sqlite3
+
+# Rows sent to sqlite per executemany call.
+INSERT_BATCH_SIZE = 50000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS frequencies (drug INTEGER NOT NULL, side_effect TEXT NOT NULL, frequency REAL NOT NULL,
+	frequency_class INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS postmarketing (drug INTEGER NOT NULL, side_effect TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS no_frequency (drug INTEGER NOT NULL, side_effect TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS indications (drug INTEGER NOT NULL, indication TEXT NOT NULL);
+'''
+
+# (name, table, columns). They are dropped before a bulk load and created after it, which is faster than
+# updating them row by row.
+INDEXES = [('frequencies_drug', 'frequencies', 'drug'),
+		   ('frequencies_side_effect', 'frequencies', 'side_effect, frequency_class'),
+		   ('frequencies_class', 'frequencies', 'frequency_class, frequency'),
+		   ('postmarketing_drug', 'postmarketing', 'drug'),
+		   ('postmarketing_side_effect', 'postmarketing', 'side_effect'),
+		   ('no_frequency_drug', 'no_frequency', 'drug'),
+		   ('no_frequency_side_effect', 'no_frequency', 'side_effect'),
+		   ('indications_drug', 'indications', 'drug'),
+		   ('indications_indication', 'indications', 'indication')]
+
+def frequency_class(frequency):
+	'''
+		WHO class (1 to 5) of an average frequency score of finalDrugSElist(...), rounded half up.
+	'''
+	return int(math.floor(frequency + 0.5))
+
+class SIDERStore(object):
+	"""
+	SQLite database with the final outputs of SIDERParser, so that they can be queried without loading them:
+		frequencies: finalDrugSElist(...) (drug, side_effect, frequency, frequency_class).
+		postmarketing: UnifySetsPostmarketing(...).
+		no_frequency: SideEffectswithNoFrequency(...).
+		indications: parser_all_indications(...).
+	Drugs are returned as str, as in the outputs of SIDERParser.
+	"""
+	def __init__(self, filename):
+		'''
+		:param filename: path of the database (created if it does not exist), or ':memory:'.
+		'''
+		# no implicit transactions: the python 2 sqlite3 module commits before every DDL statement, load() handles
+		# its own transaction.
+		self.connection = sqlite3.connect(filename, isolation_level=None)
+		# names are stored and returned as the str of the SIDER files, without decoding them.
+		self.connection.text_factory = str
+		self.connection.executescript(SCHEMA)
+
+	def close(self):
+
+		self.connection.close()
+
+	def load(self, sider_with_freq = None, sider_pmktg = None, sider_no_freq = None, sider_ind = None):
+		'''
+		Replace the contents of the tables of the given outputs, in a single transaction with batched inserts.
+		:param sider_with_freq: drug_se_profile of finalDrugSElist(...).
+		:param sider_pmktg: output of UnifySetsPostmarketing(...).
+		:param sider_no_freq: output of SideEffectswithNoFrequency(...).
+		:param sider_ind: output of parser_all_indications(...).
+		:return: number of rows inserted.
+		'''
+		tables = list()
+
+		if sider_with_freq is not None:
+			rows = ((int(drug), se, values[0], frequency_class(values[0]))
+					for drug, side_effects in sider_with_freq.iteritems() for se, values in side_effects.iteritems())
+			tables.append(('frequencies', 'INSERT INTO frequencies VALUES (?, ?, ?, ?)', rows))
+
+		for name, mydict in (('postmarketing', sider_pmktg), ('no_frequency', sider_no_freq), ('indications', sider_ind)):
+			if mydict is not None:
+				rows = ((int(drug), term) for drug, terms in mydict.iteritems() for term in terms)
+				tables.append((name, 'INSERT INTO %s VALUES (?, ?)' % name, rows))
+
+		count = 0
+		# SQLite DDL is transactional: the indexes are dropped and created in the same transaction as the rows,
+		# so a load that fails leaves the database as it was.
+		self.connection.execute('BEGIN')
+		try:
+			for name, table, columns in INDEXES:
+				self.connection.execute('DROP INDEX IF EXISTS %s' % name)
+
+			for name, statement, rows in tables:
+				self.connection.execute('DELETE FROM %s' % name)
+
+				batch = list()
+				for row in rows:
+					batch.append(row)
+					if len(batch) == INSERT_BATCH_SIZE:
+						self.connection.executemany(statement, batch)
+						count += len(batch)
+						batch = list()
+
+				self.connection.executemany(statement, batch)
+				count += len(batch)
+
+			for name, table, columns in INDEXES:
+				self.connection.execute('CREATE INDEX %s ON %s (%s)' % (name, table, columns))
+		except:
+			self.connection.execute('ROLLBACK')
+			raise
+
+		self.connection.execute('COMMIT')
+
+		self.connection.execute('ANALYZE')
+
+		return count
+
+	def __query(self, sql, params = ()):
+
+		return [(str(row[0]),) + tuple(row[1:]) for row in self.connection.execute(sql, params)]
+
+	def drug_frequencies(self, drug):
+		'''
+		:return: list of (side_effect, frequency) of the drug.
+		'''
+		return [(se, frequency) for se, frequency in
+				self.connection.execute('SELECT side_effect, frequency FROM frequencies WHERE drug = ?', (int(drug),))]
+
+	def side_effect_drugs(self, side_effect, min_class = None, max_class = None):
+		'''
+		Drugs with the side-effect, optionally with frequency_class between min_class and max_class (included).
+		:return: list of (drug, frequency), from the most frequent.
+		'''
+		sql = 'SELECT drug, frequency FROM frequencies WHERE side_effect = ?'
+		params = [side_effect]
+
+		if min_class is not None:
+			sql += ' AND frequency_class >= ?'
+			params.append(min_class)
+		if max_class is not None:
+			sql += ' AND frequency_class <= ?'
+			params.append(max_class)
+
+		return self.__query(sql + ' ORDER BY frequency DESC', params)
+
+	def frequency_range(self, low, high):
+		'''
+		All the pairs with low <= frequency <= high.
+		:return: list of (drug, side_effect, frequency).
+		'''
+		return self.__query('SELECT drug, side_effect, frequency FROM frequencies WHERE frequency_class BETWEEN ? AND ? '
+							'AND frequency BETWEEN ? AND ?', (frequency_class(low), frequency_class(high), low, high))
+
+	def __terms(self, table, column, drug):
+
+		return [row[0] for row in self.connection.execute('SELECT %s FROM %s WHERE drug = ?' % (column, table), (int(drug),))]
+
+	def __drugs(self, table, column, term):
+
+		return [str(row[0]) for row in self.connection.execute('SELECT drug FROM %s WHERE %s = ?' % (table, column), (term,))]
+
+	def postmarketing(self, drug):
+		'''
+		Post-marketing side-effects of the drug.
+		'''
+		return self.__terms('postmarketing', 'side_effect', drug)
+
+	def no_frequency(self, drug):
+		'''
+		Side-effects of the drug with no frequency information.
+		'''
+		return self.__terms('no_frequency', 'side_effect', drug)
+
+	def indications(self, drug):
+		'''
+		Indications of the drug.
+		'''
+		return self.__terms('indications', 'indication', drug)
+
+	def indication_drugs(self, indication):
+		'''
+		Drugs with the indication.
+		'''
+		return self.__drugs('indications', 'indication', indication)
+
+	def postmarketing_drugs(self, side_effect):
+		'''
+		Drugs with the side-effect in post-marketing.
+		'''
+		return self.__drugs('postmarketing', 'side_effect', side_effect)
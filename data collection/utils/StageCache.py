@@ -0,0 +1,162 @@
+import cPickle
+import glob
+import hashlib
+import os
+
+import Parsers as parsers
+
+# Default size limit of the cache directory (bytes).
+CACHE_MAX_BYTES = 2 << 30
+
+# Block size used to hash the input files.
+HASH_BLOCK_SIZE = 1 << 20
+
+def code_version(directory = None):
+	'''
+	Hash of the sources of the modules in directory (by default, the utils folder), so that the cached
+	results are not used anymore once the code that produced them changes.
+	:return: hex digest.
+	'''
+	if directory is None:
+		directory = os.path.dirname(os.path.abspath(__file__))
+
+	digest = hashlib.sha1()
+	for filename in sorted(glob.glob(os.path.join(directory, '*.py'))):
+		digest.update(os.path.basename(filename))
+		with open(filename, 'rb') as f:
+			digest.update(f.read())
+
+	return digest.hexdigest()
+
+class StageCache(object):
+	"""
+	On-disk cache of the outputs of the pipeline stages, addressed by content: the key of a result is a hash of
+	the contents of its input files, the stage parameters and the code version. The results are pickled
+	(highest protocol) into directory, and the least recently used ones are removed when the directory
+	grows over max_bytes.
+	"""
+	def __init__(self, directory, max_bytes = CACHE_MAX_BYTES, version = None):
+		'''
+		:param directory: folder of the cache, e.g. EasyParsers().get_results_directory() + 'cache/'.
+		:param max_bytes: size limit of the folder.
+		:param version: code version, by default code_version() of the utils folder.
+		'''
+		self.directory = directory
+		self.max_bytes = max_bytes
+
+		if version is None:
+			version = code_version()
+		self.version = version
+
+		# (path, size, mtime) -> hash of the file, so each input is read once per session.
+		self.__file_hashes = dict()
+
+	def file_hash(self, filename):
+		'''
+		Hash of the contents of the file.
+		'''
+		stat = os.stat(filename)
+		key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+
+		if key not in self.__file_hashes:
+			digest = hashlib.sha1()
+			with open(filename, 'rb') as f:
+				for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+					digest.update(block)
+			self.__file_hashes[key] = digest.hexdigest()
+
+		return self.__file_hashes[key]
+
+	def key(self, stage, input_files = (), params = None):
+		'''
+		:param stage: name of the stage.
+		:param input_files: paths of the files the stage reads (directly or through the previous stages).
+		:param params: dict of the parameters of the stage (e.g. {'term': 'PT'}).
+		:return: hex digest.
+		'''
+		digest = hashlib.sha1()
+		digest.update(stage)
+		digest.update(self.version)
+
+		for filename in input_files:
+			digest.update(self.file_hash(filename))
+
+		digest.update(repr(sorted((params or {}).items())))
+
+		return digest.hexdigest()
+
+	def __path(self, key):
+
+		return os.path.join(self.directory, key + '.pkl')
+
+	def get(self, key):
+		'''
+		:return: (True, value) if the key is in the cache, (False, None) otherwise.
+		'''
+		path = self.__path(key)
+
+		try:
+			with open(path, 'rb') as f:
+				value = cPickle.load(f)
+		except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+			return False, None
+
+		# mtime is the last use, for the LRU eviction.
+		os.utime(path, None)
+
+		return True, value
+
+	def put(self, key, value):
+		'''
+		Store the value. It is written to a temporary file first, so a crash never leaves a broken entry.
+		'''
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+
+		with parsers.atomic_write(self.__path(key)) as f:
+			cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+
+		self.evict()
+
+	def get_or_compute(self, key, compute):
+		'''
+		Cached value of the key, or compute() (stored for the next time).
+		'''
+		hit, value = self.get(key)
+
+		if not hit:
+			value = compute()
+			self.put(key, value)
+
+		return value
+
+	def evict(self):
+		'''
+		Remove the least recently used entries until the cache fits in max_bytes.
+		'''
+		entries = list()
+		for path in glob.glob(os.path.join(self.directory, '*.pkl')):
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, path))
+
+		total = sum(size for mtime, size, path in entries)
+
+		for mtime, size, path in sorted(entries):
+			if total <= self.max_bytes:
+				break
+
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+
+	def clear(self):
+		'''
+		Remove all the entries.
+		'''
+		for path in glob.glob(os.path.join(self.directory, '*.pkl')):
+			os.remove(path)
@@ -1,10 +1,14 @@
 import operator
 import numpy as np
+import scipy.sparse
 
 __author__ = 'diegogaleano'
 __email__  = 'Diego.Galeano.2014@rhul.live.ac.uk'
 __date__  = '19-10-2016'
 
+# Number of (row list, column list) orderings whose index maps are kept by MyUtilities.MatrixIndex.
+INDEX_CACHE_SIZE = 8
+
 class MyUtilities(object):
 	"""
 	Implementation of sub-structural analysis algorithms.
@@ -14,73 +18,241 @@ class MyUtilities(object):
 
 		self.directory_file = directory_file
 		
-	def DoubleDicttoMatrix(self, mydict):
+		# (row list, column list) -> (row_index, column_index), see MatrixIndex.
+		self.__index_cache = dict()
+		
+	def DoubleDicttoMatrix(self, mydict, sparse = False, format = 'csr'):
 		'''
 			Create a numpy matrix.
 				rows: key1 of the dictionary.
 				columns: key2 of the dictionary.
+			Rows and columns are in sorted order, and only the entries present in the dictionary are visited.
+			
+			sparse: return a scipy.sparse matrix instead of a dense one.
+			format: 'csr' or 'coo', format of the sparse matrix.
 				
 			returns:
 				matrix, rows_keys, column_keys
 		'''
 		
-		rows = list(mydict.keys())
+		rows = sorted(mydict.keys())
 		columns = set()
 		for r in rows: 
-			for v in mydict[r]:
-				columns.add(v)
+			columns.update(mydict[r])
 		
-		columns = list(columns)
+		columns = sorted(columns)
 		
-		N1 = len(rows)
-		N2 = len(columns)		
-		M = np.zeros(shape=(N1,N2))
+		row_index = dict((r, idx) for idx, r in enumerate(rows))
+		column_index = dict((c, idx) for idx, c in enumerate(columns))
 		
-		for idx1, r in enumerate(rows):							
-			for idx2,c in enumerate(columns):				
-				if c in mydict[r]:					
-					M[idx1][idx2] = mydict[r][c][0]
+		M = self.__build_matrix(mydict, row_index, column_index, sparse, format)
 				
 		return M, rows, columns
 		
-	def DoubleDicttoMatrixConstrained(self, mydict, my_row_list, my_col_list):
+	def __build_matrix(self, mydict, row_index, column_index, sparse = False, format = 'csr', value = None):
+		'''
+			Matrix of the entries of mydict whose row and column are in row_index and column_index
+			(dicts key -> position). The entries are gathered in coordinate form and written all at once.
+			
+			value: value of every present entry, otherwise mydict[r][c][0].
+		'''
+		
+		I = list()
+		J = list()
+		V = list()
+		
+		for r, cols in mydict.iteritems():
+			idx1 = row_index.get(r)
+			if idx1 is None:
+				continue
+			
+			for c in cols:
+				idx2 = column_index.get(c)
+				if idx2 is None:
+					continue
+				
+				v = cols[c][0] if value is None else value
+				
+				if isinstance(idx1, list) or isinstance(idx2, list):
+					# label repeated in the row or column list.
+					for i in (idx1 if isinstance(idx1, list) else [idx1]):
+						for j in (idx2 if isinstance(idx2, list) else [idx2]):
+							I.append(i)
+							J.append(j)
+							V.append(v)
+				else:
+					I.append(idx1)
+					J.append(idx2)
+					V.append(v)
+		
+		shape = (self.__length(row_index), self.__length(column_index))
+		
+		if sparse:
+			M = scipy.sparse.coo_matrix((np.array(V, dtype=float), (np.array(I, dtype=np.int64), np.array(J, dtype=np.int64))), shape=shape)
+			return M.asformat(format)
+		
+		M = np.zeros(shape=shape)
+		M[I, J] = V
+		
+		return M
+		
+	def MatrixIndex(self, my_row_list, my_col_list):
+		'''
+			label -> position maps of a row list and a column list, for the constrained builders.
+			The maps of the last orderings used are cached, so repeated calls with the same lists
+			(e.g. the drugs and side-effects of FrequencyData.mat) do not rebuild them.
+			
+			returns:
+				row_index, column_index
+		'''
+		
+		key = (tuple(my_row_list), tuple(my_col_list))
+		
+		index = self.__index_cache.get(key)
+		if index is None:
+			if len(self.__index_cache) >= INDEX_CACHE_SIZE:
+				self.__index_cache.clear()
+			
+			index = (self.__positions(my_row_list), self.__positions(my_col_list))
+			self.__index_cache[key] = index
+		
+		return index
+	
+	def __positions(self, my_list):
+		'''
+			label -> position(s). A label repeated in the list gets all its positions.
+		'''
+		positions = dict()
+		for idx, label in enumerate(my_list):
+			positions.setdefault(label, list()).append(idx)
+		
+		if all(len(p) == 1 for p in positions.itervalues()):
+			return dict((label, p[0]) for label, p in positions.iteritems())
+		
+		return positions
+	
+	def __constrained_index(self, my_row_list, my_col_list):
+		'''
+			The lists can be given directly as label -> position dicts (e.g. from MatrixIndex).
+		'''
+		if isinstance(my_row_list, dict) and isinstance(my_col_list, dict):
+			return my_row_list, my_col_list
+		
+		row_index, column_index = self.MatrixIndex(list(my_row_list), list(my_col_list))
+		
+		if isinstance(my_row_list, dict):
+			row_index = my_row_list
+		if isinstance(my_col_list, dict):
+			column_index = my_col_list
+		
+		return row_index, column_index
+		
+	def DoubleDicttoMatrixConstrained(self, mydict, my_row_list, my_col_list, sparse = False, format = 'csr'):
 		'''
 			Create a numpy matrix.
 				rows: key1 of the dictionary.
 				columns: key2 of the dictionary.
+			my_row_list, my_col_list: order of the rows and columns, as lists or as label -> position
+				dicts (see MatrixIndex). Only the entries present in the dictionary are visited.
+			sparse: return a scipy.sparse matrix ('csr' or 'coo', see format) instead of a dense one.
 				
 			returns:
-				matrix, rows_keys, column_keys
+				matrix
 		'''
 		
-		N1 = len(my_row_list)
-		N2 = len(my_col_list)		
-		M = np.zeros(shape=(N1,N2))
+		row_index, column_index = self.__constrained_index(my_row_list, my_col_list)
 		
-		for idx1, r in enumerate(my_row_list):							
-			for idx2,c in enumerate(my_col_list):				
-				if r in mydict and c in mydict[r]:					
-					M[idx1][idx2] = mydict[r][c][0]
-				
-		return M
+		return self.__build_matrix(mydict, row_index, column_index, sparse, format)
 		
-	def DoubleDicttoMatrixConstrainedValue(self, mydict, my_row_list, my_col_list, value= 1):
+	def DoubleDicttoMatrixConstrainedValue(self, mydict, my_row_list, my_col_list, value= 1, sparse = False, format = 'csr'):
 		'''
 			Create a numpy matrix.
 				rows: key1 of the dictionary.
 				columns: key2 of the dictionary.
+			my_row_list, my_col_list: order of the rows and columns, as lists or as label -> position
+				dicts (see MatrixIndex). Only the entries present in the dictionary are visited.
+			sparse: return a scipy.sparse matrix ('csr' or 'coo', see format) instead of a dense one.
 				
 			returns:
-				matrix, rows_keys, column_keys
+				matrix
+		'''
+		
+		row_index, column_index = self.__constrained_index(my_row_list, my_col_list)
+		
+		return self.__build_matrix(mydict, row_index, column_index, sparse, format, value)
+		
+	def IndexedDoubleDicttoMatrix(self, mydict, N1, N2, value = None, sparse = False, format = 'csr'):
+		'''
+			Create a numpy matrix from a dictionary in integer space (see Vocabulary.SIDERVocabulary.encode_profile).
+				rows: key1 of the dictionary, already the row index.
+				columns: key2 of the dictionary, already the column index.
+			Only the entries present in the dictionary are visited, the ones outside N1 x N2 are skipped.
+			
+			value: value of every present entry (e.g. 1 for sets), otherwise mydict[r][c][0].
+			sparse: return a scipy.sparse matrix ('csr' or 'coo', see format) instead of a dense one.
+				
+			returns:
+				matrix
+		'''
+		
+		row_index = dict((idx, idx) for idx in xrange(N1))
+		column_index = dict((idx, idx) for idx in xrange(N2))
+		
+		return self.__build_matrix(mydict, row_index, column_index, sparse, format, value)
+		
+	def __length(self, index):
 		'''
+			Number of rows (or columns) of a label -> position(s) map.
+		'''
+		n = 0
+		for p in index.itervalues():
+			n = max(n, (max(p) if isinstance(p, list) else p) + 1)
 		
-		N1 = len(my_row_list)
-		N2 = len(my_col_list)		
-		M = np.zeros(shape=(N1,N2))
+		return n
 		
-		for idx1, r in enumerate(my_row_list):							
-			for idx2,c in enumerate(my_col_list):				
-				if r in mydict and c in mydict[r]:					
-					M[idx1][idx2] = value
+	def GroupedMean(self, values, lengths):
+		'''
+			Mean of consecutive groups of values, all the groups at once.
+				values: the values of the groups, one group after the other.
+				lengths: number of values of each group.
 				
-		return M
\ No newline at end of file
+			returns:
+				array with the mean of each group (nan for empty groups).
+		'''
+		
+		values = np.asarray(values, dtype=float)
+		lengths = np.asarray(lengths, dtype=np.int64)
+		
+		groups = np.repeat(np.arange(len(lengths)), lengths)
+		sums = np.bincount(groups, weights=values, minlength=len(lengths))
+		
+		with np.errstate(invalid='ignore', divide='ignore'):
+			return sums / lengths
+		
+	def GroupedMedian(self, values, lengths):
+		'''
+			Median of consecutive groups of values, all the groups at once.
+				values: the values of the groups, one group after the other.
+				lengths: number of values of each group.
+				
+			returns:
+				array with the median of each group (nan for empty groups), as numpy.median would give.
+		'''
+		
+		values = np.asarray(values, dtype=float)
+		lengths = np.asarray(lengths, dtype=np.int64)
+		
+		# sort the values inside each group.
+		groups = np.repeat(np.arange(len(lengths)), lengths)
+		ordered = values[np.lexsort((values, groups))]
+		
+		offsets = np.cumsum(lengths) - lengths
+		medians = np.full(len(lengths), np.nan)
+		present = lengths > 0
+		
+		# the two middle values (the same one for odd lengths).
+		low = ordered[offsets[present] + (lengths[present] - 1) // 2]
+		high = ordered[offsets[present] + lengths[present] // 2]
+		medians[present] = (low + high) / 2.0
+		
+		return medians
\ No newline at end of file
@@ -0,0 +1,166 @@
+import threading
+import numpy as np
+
+class Vocabulary(object):
+	"""
+	Dense integer IDs (0, 1, 2, ...) for labels, in order of insertion.
+	New labels are added under a lock, so stages running in threads (Pipeline.py) can share the vocabulary.
+	"""
+	def __init__(self, labels = ()):
+
+		self.index = dict()
+		self.labels = list()
+		self.__lock = threading.Lock()
+
+		for label in labels:
+			self.add(label)
+
+	def add(self, label):
+		'''
+		Add the label if it is new.
+		:param label:
+		:return: ID of the label.
+		'''
+		idx = self.index.get(label)
+
+		if idx is None:
+			with self.__lock:
+				idx = self.index.get(label)
+				if idx is None:
+					idx = len(self.labels)
+					self.labels.append(label)
+					self.index[label] = idx
+
+		return idx
+
+	def get(self, label, default = None):
+		'''
+		ID of the label, or default if it is not in the vocabulary.
+		'''
+		return self.index.get(label, default)
+
+	def label(self, idx):
+		'''
+		Label of the ID.
+		'''
+		return self.labels[idx]
+
+	def encode(self, labels):
+		'''
+		IDs of a list of labels (all of them should be in the vocabulary).
+		:return: numpy array of int.
+		'''
+		return np.array([self.index[label] for label in labels], dtype=np.int64)
+
+	def decode(self, ids):
+		'''
+		Labels of a list of IDs.
+		:return: list
+		'''
+		return [self.labels[idx] for idx in ids]
+
+	def __getstate__(self):
+
+		state = self.__dict__.copy()
+		del state['_Vocabulary__lock']
+		return state
+
+	def __setstate__(self, state):
+
+		self.__dict__.update(state)
+		self.__lock = threading.Lock()
+
+	def __getitem__(self, label):
+
+		return self.index[label]
+
+	def __contains__(self, label):
+
+		return label in self.index
+
+	def __iter__(self):
+
+		return iter(self.labels)
+
+	def __len__(self):
+
+		return len(self.labels)
+
+class SIDERVocabulary(object):
+	"""
+	Shared vocabulary of the SIDER pipeline: drugs (stereo ID, as int) and MedDRA terms (side-effects and
+	indications, normalized with lower().strip()).
+	"""
+	def __init__(self):
+
+		self.drugs = Vocabulary()
+		self.terms = Vocabulary()
+
+		# raw name -> normalized and interned name.
+		self.__normalized = dict()
+
+	def term(self, name):
+		'''
+		Normalized MedDRA name. Each distinct raw name is normalized once and always maps to the same
+		(interned) string object, so the parsers do not keep a copy of it for every row.
+		:param name: name as found in the SIDER files.
+		:return: str
+		'''
+		term = self.__normalized.get(name)
+
+		if term is None:
+			term = intern(name.lower().strip())
+			self.__normalized[name] = term
+
+		return term
+
+	def add_profile(self, drug_dict):
+		'''
+		Add the drugs and terms of a dict {drug: {term: ...}} or {drug: set(terms)}, e.g. the output of
+		parser_meddra_all_se(...) or finalDrugSElist(...). They are added in sorted order, so the IDs
+		do not depend on the order in which the dict is iterated.
+		'''
+		for drug in sorted(drug_dict, key=int):
+			self.drugs.add(int(drug))
+
+		terms = set()
+		for drug_terms in drug_dict.itervalues():
+			terms.update(drug_terms)
+
+		for term in sorted(terms):
+			self.terms.add(term)
+
+	def encode_profile(self, drug_dict):
+		'''
+		Move a dict {drug: {term: value}} or {drug: set(terms)} to integer space: drugs and terms are
+		replaced by their IDs (new ones are added, see add_profile).
+		:return: dict of the same shape.
+		'''
+		self.add_profile(drug_dict)
+
+		encoded = dict()
+		for drug, drug_terms in drug_dict.iteritems():
+			drug_idx = self.drugs[int(drug)]
+
+			if isinstance(drug_terms, dict):
+				encoded[drug_idx] = dict((self.terms[term], value) for term, value in drug_terms.iteritems())
+			else:
+				encoded[drug_idx] = set(self.terms[term] for term in drug_terms)
+
+		return encoded
+
+	def decode_profile(self, drug_dict):
+		'''
+		Inverse of encode_profile. Drugs are given back as str, as in the outputs of SIDERParser.
+		:return: dict of the same shape.
+		'''
+		decoded = dict()
+		for drug_idx, drug_terms in drug_dict.iteritems():
+			drug = str(self.drugs.label(drug_idx))
+
+			if isinstance(drug_terms, dict):
+				decoded[drug] = dict((self.terms.label(term), value) for term, value in drug_terms.iteritems())
+			else:
+				decoded[drug] = set(self.terms.label(term) for term in drug_terms)
+
+		return decoded
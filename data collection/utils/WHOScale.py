@@ -0,0 +1,95 @@
+import bisect
+import numpy as np
+
+# WHO frequency labels, from the lowest to the highest class (scores 1 to 5).
+WHO_LABELS = ['veryrare', 'rare', 'infrequent', 'frequent', 'veryfrequent']
+
+# Lower bounds (in %) of rare, infrequent, frequent and very frequent.
+WHO_THRESHOLDS = [0.01, 0.1, 1, 10]
+
+# WHO class (1 to 5) of the frequency labels of SIDER, once normalized (see SIDERParser.__NormalizeFrequencyLabels).
+# They do not depend on the labels of the scale: each class is placed in the bin of its lower bound.
+SIDER_LABEL_CLASSES = {'veryrare': 1, 'rare': 2, 'infrequent': 3, 'frequent': 4, 'veryfrequent': 5}
+
+class WHOFrequencyScale(object):
+	"""
+	Mapping of side-effect frequencies to the WHO classes (Collaborating Centre for Drug Statistics Methodology):
+				very common >= 10%
+		 1% <=  common or frequent < 10%
+	   0.1% <=  uncommon or infrequent < 1%
+	  0.01% <=  rare     < 0.1%
+				very rare < 0.01%
+	The classes are scored 1 (very rare) to 5 (very frequent); anything else (postmarketing, unknown
+	labels, nan) is scored -1. Other binnings can be used by giving other thresholds: the SIDER labels
+	('rare', 'frequent', ...) are then scored with the bin of the lower bound of their WHO class.
+	"""
+	def __init__(self, thresholds = WHO_THRESHOLDS, labels = WHO_LABELS):
+		'''
+		:param thresholds: increasing lower bounds (in %) of the classes, except the first one.
+		:param labels: one label per class, len(thresholds) + 1 (returned by label(...)).
+		'''
+		if len(labels) != len(thresholds) + 1:
+			raise ValueError('There should be one label more than thresholds.')
+
+		self.thresholds = np.asarray(thresholds, dtype=float)
+		self.labels = list(labels)
+
+		# plain list for the single value lookups (bisect), faster than numpy on scalars.
+		self.__thresholds = self.thresholds.tolist()
+
+		# precomputed SIDER label -> score table.
+		lower_bounds = [0] + WHO_THRESHOLDS
+		self.label_scores = dict((label, self.score(lower_bounds[who_class - 1]))
+								 for label, who_class in SIDER_LABEL_CLASSES.iteritems())
+
+	def scores(self, frequencies):
+		'''
+		Scores of a vector of frequencies.
+		:param frequencies: array of percentages.
+		:return: numpy array of int.
+		'''
+		frequencies = np.asarray(frequencies, dtype=float)
+
+		scores = np.searchsorted(self.thresholds, frequencies, side='right') + 1
+		scores[np.isnan(frequencies)] = -1
+
+		return scores
+
+	def score(self, fq):
+		'''
+		Score of a single frequency.
+		'''
+		if fq != fq: # nan
+			return -1
+
+		return bisect.bisect_right(self.__thresholds, fq) + 1
+
+	def label(self, fq):
+		'''
+		Label of a single frequency ('error' if it is not a number).
+		'''
+		score = self.score(fq)
+
+		if score < 0:
+			return 'error'
+
+		return self.labels[score - 1]
+
+	def label_score(self, label):
+		'''
+		Score of a single SIDER label (e.g. 'frequent'), -1 for the others (e.g. 'postmarketing').
+		'''
+		return self.label_scores.get(label, -1)
+
+	def labels_to_scores(self, labels):
+		'''
+		Scores of a list of SIDER labels, looked up once per distinct label.
+		:return: numpy array of int.
+		'''
+		if len(labels) == 0:
+			return np.zeros(0, dtype=np.int64)
+
+		unique_labels, inverse = np.unique(np.asarray(labels, dtype=object), return_inverse=True)
+		table = np.array([self.label_score(label) for label in unique_labels], dtype=np.int64)
+
+		return table[inverse]